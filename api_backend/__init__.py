@@ -1,12 +1,9 @@
 __version__ = "0.1.0"
-import bson
-import uuid
 import flask_cors
 import flask_jwt_extended
 from flask_apispec import FlaskApiSpec
 from collections import namedtuple
 from functools import wraps
-import pymongo
 import werkzeug.exceptions
 from flask import Flask, jsonify
 
@@ -40,14 +37,13 @@ def make_app(config, for_manage) -> Flask:
     return App
   
   # for logout
+  from .services.revoked_jti import RevokedJtiService
+  from .utils.mongo_client import get_mongo_client
   jwt_mngr = flask_jwt_extended.JWTManager(app)
-  blacklist_jti_collection = pymongo.MongoClient(config.MONGO_MAIN_URI).get_database().blacklistjtis
+  revoked_jti_service = RevokedJtiService(get_mongo_client(config.MONGO_MAIN_URI))
   @jwt_mngr.token_in_blocklist_loader
   def __check_if_token_revoked__(_, jwt_payload):
-    token_in_blacklist = blacklist_jti_collection.find_one({
-      "_id": bson.Binary.from_uuid(uuid.UUID(jwt_payload["jti"])),
-    })
-    return token_in_blacklist is not None
+    return revoked_jti_service.is_revoked(jwt_payload["jti"])
 
   if config.USE_CORS:
     flask_cors.CORS(app)
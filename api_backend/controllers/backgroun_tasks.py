@@ -5,13 +5,14 @@ from api_backend.dtos.background_tasks import (
   ApproveDraftImportOptionsDto,
   EstateCustomerInfoExportOptionDto,
   EstateCustomerInfoImportOptionDto,
+  TaskQueueStatsDto,
   XlsxUploadDto,
 )
 from api_backend.dtos.customer_info import FilterCustomerInfoDto
 from api_backend.schemas import SchedulerTaskSchema
 from api_backend.services.background_tasks import BackgroundTaskService
-from flask_jwt_extended import get_jwt_identity, jwt_required
-from api_backend.utils.auth_utils import check_permission
+from flask_jwt_extended import get_jwt, get_jwt_identity, jwt_required
+from api_backend.utils.auth_utils import admins_only, check_permission
 from api_backend.utils.mongo_helpers import validate_object_id
 from config import Config
 from constants import APITags, Permission, PermissionTargets
@@ -32,6 +33,23 @@ def get_task_by_id(task_id):
   target_task = bg_service.get_task_by_id(validate_object_id(task_id))
   return flask.jsonify(SchedulerTaskSchema().dump(target_task))
 
+@blueprint.route('/task_id/<task_id>/cancel', methods=['POST'])
+@jwt_required()
+@doc(
+  summary='cancel a pending or running task, running tasks stop at their next batch and partial drafts are discarded, creator or admin only',
+  tags=[APITags.file_ops],
+  security=[Config.JWT_SECURITY_OPTION],
+)
+@marshal_with(SchedulerTaskSchema)
+def cancel_task_by_id(task_id):
+  user_id = get_jwt_identity()
+  target_task = bg_service.cancel_task_by_id(
+    validate_object_id(user_id),
+    validate_object_id(task_id),
+    is_admin=bool(get_jwt().get("is_admin")),
+  )
+  return flask.jsonify(SchedulerTaskSchema().dump(target_task))
+
 @blueprint.route('/customer_info_xlsx/draft/estate_info_id/<estate_info_id>', methods=['POST'])
 @check_permission(PermissionTargets.estate_customer_info, Permission.write)
 @doc(
@@ -79,6 +97,7 @@ def approve_customer_info_import_task_by_id(draft_import_task_id, **kwargs):
     validate_object_id(user_id),
     validate_object_id(draft_import_task_id),
     allow_minor_format_errors=allow_minor_format_errors,
+    promotion_mode=kwargs.get("promotion_mode"),
   )
   return flask.jsonify(SchedulerTaskSchema().dump(new_task))
 
@@ -104,7 +123,7 @@ def reject_customer_info_import_task_by_id(draft_import_task_id):
 @blueprint.route('/customer_info_xlsx/export_by_filter', methods=['POST'])
 @check_permission(PermissionTargets.estate_customer_info, Permission.read)
 @doc(
-  summary='export customer info, permission <%s:%s> required' % (
+  summary='export customer info as xlsx, csv, csv.gz or parquet, permission <%s:%s> required' % (
     PermissionTargets.estate_customer_info,
     Permission.read,
   ),
@@ -167,6 +186,7 @@ def approve_customer_blacklist_import_task_by_id(draft_import_task_id, **kwargs)
     validate_object_id(user_id),
     validate_object_id(draft_import_task_id),
     allow_minor_format_errors=allow_minor_format_errors,
+    promotion_mode=kwargs.get("promotion_mode"),
   )
   return flask.jsonify(SchedulerTaskSchema().dump(new_task))
 
@@ -188,3 +208,67 @@ def reject_customer_blacklist_import_task_by_id(draft_import_task_id):
     validate_object_id(draft_import_task_id),
   )
   return flask.jsonify(SchedulerTaskSchema().dump(new_task))
+
+# maintenance
+@blueprint.route('/queue_stats', methods=['GET'])
+@admins_only()
+@doc(
+  summary='pending and running task counts and waiting time by task type and creator, admin only',
+  tags=[APITags.file_ops],
+  security=[Config.JWT_SECURITY_OPTION],
+)
+@marshal_with(TaskQueueStatsDto)
+def get_queue_stats():
+  return flask.jsonify(TaskQueueStatsDto().dump(bg_service.get_queue_stats()))
+
+@blueprint.route('/search_fields/rebuild', methods=['POST'])
+@admins_only()
+@doc(
+  summary='rebuild derived search fields (phone digits and hash, name tokens) of customers, blacklists, estates and tags, admin only',
+  tags=[APITags.file_ops],
+  security=[Config.JWT_SECURITY_OPTION],
+)
+@marshal_with(SchedulerTaskSchema)
+def rebuild_search_fields():
+  user_id = get_jwt_identity()
+  new_task = bg_service.rebuild_search_fields(validate_object_id(user_id))
+  return flask.jsonify(SchedulerTaskSchema().dump(new_task))
+
+@blueprint.route('/customer_info/dedup', methods=['POST'])
+@admins_only()
+@doc(
+  summary='merge customer info sharing the same estate and phone, run before building the unique index, admin only',
+  tags=[APITags.file_ops],
+  security=[Config.JWT_SECURITY_OPTION],
+)
+@marshal_with(SchedulerTaskSchema)
+def dedup_customer_info():
+  user_id = get_jwt_identity()
+  new_task = bg_service.dedup_customer_info(validate_object_id(user_id))
+  return flask.jsonify(SchedulerTaskSchema().dump(new_task))
+
+@blueprint.route('/customer_blacklist/dedup', methods=['POST'])
+@admins_only()
+@doc(
+  summary='merge customer blacklist entries sharing the same phone, run before building the unique index, admin only',
+  tags=[APITags.file_ops],
+  security=[Config.JWT_SECURITY_OPTION],
+)
+@marshal_with(SchedulerTaskSchema)
+def dedup_customer_blacklist():
+  user_id = get_jwt_identity()
+  new_task = bg_service.dedup_customer_blacklist(validate_object_id(user_id))
+  return flask.jsonify(SchedulerTaskSchema().dump(new_task))
+
+@blueprint.route('/stats_counters/reconcile', methods=['POST'])
+@admins_only()
+@doc(
+  summary='recount the homepage counters (estate and customer totals, customers per estate), run once after deploying them, admin only',
+  tags=[APITags.file_ops],
+  security=[Config.JWT_SECURITY_OPTION],
+)
+@marshal_with(SchedulerTaskSchema)
+def reconcile_stats_counters():
+  user_id = get_jwt_identity()
+  new_task = bg_service.reconcile_stats_counters(validate_object_id(user_id))
+  return flask.jsonify(SchedulerTaskSchema().dump(new_task))
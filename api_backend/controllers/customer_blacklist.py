@@ -2,7 +2,7 @@ import flask
 from flask_apispec import doc, marshal_with, use_kwargs
 from flask_jwt_extended import get_jwt_identity
 from api_backend.dtos.customer_blacklist import (
-  FilterCustomerBlacklistDto,
+  CountCustomerBlacklistDto,
   PagedCustomerBlacklistDto,
   QueryCustomerBlacklistDto,
   UpsertCustomerBlacklistDto,
@@ -61,10 +61,11 @@ def query(**query):
   security=[Config.JWT_SECURITY_OPTION],
 )
 @check_permission(PermissionTargets.estate_customer_info, Permission.read)
-@use_kwargs(FilterCustomerBlacklistDto)
+@use_kwargs(CountCustomerBlacklistDto)
 @marshal_with(GenericMatchCountDto)
 def count(**query):
-  result = customer_blacklist_service.count_by_filter(query)
+  approximate = query.pop("approximate", False)
+  result = customer_blacklist_service.count_by_filter(query, approximate=approximate)
   return flask.jsonify(GenericMatchCountDto().dump(result))
 
 
@@ -2,7 +2,10 @@ import pytz
 import flask
 from datetime import datetime
 from flask_apispec import doc, marshal_with
-from api_backend.schemas import HeartBeatSchema
+from api_backend.schemas import HeartBeatSchema, MongoPoolStatsSchema
+from api_backend.utils.auth_utils import admins_only
+from api_backend.utils.mongo_client import get_mongo_pool_stats
+from config import Config
 import constants
 
 name = __name__.replace(".", "_")
@@ -23,3 +26,14 @@ def root():
 @blueprint.route("/_ah/warmup", methods=["GET"])
 def get_warmup():
   return "", 204
+
+@blueprint.route("/mongo_pool_stats", methods=["GET"])
+@admins_only()
+@doc(
+  summary="mongo connection pool counters of the answering process, admin only",
+  tags=[constants.APITags.root],
+  security=[Config.JWT_SECURITY_OPTION],
+)
+@marshal_with(MongoPoolStatsSchema)
+def get_mongo_pool_stats_of_process():
+  return flask.jsonify(MongoPoolStatsSchema().dump(get_mongo_pool_stats()))
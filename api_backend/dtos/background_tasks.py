@@ -1,4 +1,6 @@
-from marshmallow import fields, Schema
+from marshmallow import fields, Schema, validate
+from api_backend.schemas import ObjectIdHelper
+from constants import ExportFormats, PromotionModes, TaskTypes, enum_set
 
 class XlsxUploadDto(Schema):
   xlsx = fields.Raw(required=True, type="file")
@@ -8,6 +10,34 @@ class EstateCustomerInfoImportOptionDto(Schema):
 
 class EstateCustomerInfoExportOptionDto(Schema):
   timezone_offset = fields.Integer(missing=+8)
+  format = fields.String(
+    missing=ExportFormats.xlsx,
+    validate=validate.OneOf(enum_set(ExportFormats)),
+    metadata={ "example": ExportFormats.csv_gz },
+  )
 
 class ApproveDraftImportOptionsDto(Schema):
   allow_minor_format_errors = fields.Boolean(missing=False)
+  promotion_mode = fields.String(
+    missing=PromotionModes.merge,
+    validate=validate.OneOf(enum_set(PromotionModes)),
+    metadata={ "example": PromotionModes.merge },
+  )
+
+class TaskQueueStatsDto(Schema):
+  class TaskTypeQueueStatsDto(Schema):
+    task_type = fields.String(metadata={ "example": TaskTypes.import_customer_xlsx_to_draft })
+    priority = fields.Integer()
+    pending_count = fields.Integer()
+    running_count = fields.Integer()
+    # age of the oldest pending task of this type
+    max_wait_seconds = fields.Float()
+  class CreatorQueueStatsDto(Schema):
+    creator_id = ObjectIdHelper()
+    pending_count = fields.Integer()
+    running_count = fields.Integer()
+  pending_count = fields.Integer()
+  running_count = fields.Integer()
+  task_types = fields.List(fields.Nested(TaskTypeQueueStatsDto))
+  creators = fields.List(fields.Nested(CreatorQueueStatsDto))
+  max_running_per_creator = fields.Integer()
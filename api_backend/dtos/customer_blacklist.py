@@ -8,6 +8,12 @@ class FilterCustomerBlacklistDto(Schema):
   class Meta:
     unknown = EXCLUDE
 
+class CountCustomerBlacklistDto(FilterCustomerBlacklistDto):
+  # accepted for parity with customer info counts, phones are unique here
+  approximate = fields.Boolean(missing=False)
+  class Meta:
+    unknown = EXCLUDE
+
 class QueryCustomerBlacklistDto(FilterCustomerBlacklistDto, GenericPagedQueryDto):
   class Meta:
     unknown = EXCLUDE
@@ -32,6 +32,12 @@ class SortCustomerInfoDto(Schema):
   )
   order = fields.Integer(validate=validate.OneOf([-1, 1]), metadata={ "example": -1 },)
 
+class CountCustomerInfoDto(FilterCustomerInfoDto):
+  # estimate distinct_matched_count instead of grouping every matched document
+  approximate = fields.Boolean(missing=False)
+  class Meta:
+    unknown = EXCLUDE
+
 default_customer_info_sort_option = { "field": "info_date", "order": -1 }
 
 class QueryCustomerInfoDto(FilterCustomerInfoDto, GenericPagedQueryDto):
@@ -29,6 +29,8 @@ def create_page_result_dto(item_schema: Type[Schema]):
     page_size = fields.Integer()
     page_number = fields.Integer()
     has_more = fields.Boolean()
+    # opaque keyset token of the last row, pass it as `cursor` to fetch the next page
+    next_cursor = fields.String()
 
     # matched count is for preview of export tasks
     matched_count = fields.Integer()
@@ -50,8 +52,13 @@ class GenericPagedQueryDto(Schema):
     validate=[Range(min=1, error="Value must >= 1")],
     metadata={ "example":  1 },
   )
+  # keyset pagination, `next_cursor` of the previous page, page_number is ignored when set
+  cursor = fields.String(allow_none=True, missing=None)
 
 class GenericMatchCountDto(Schema):
   grouped_fields = fields.List(fields.String(metadata={ "example": "phone" }))
   matched_count = fields.Integer(missing=0)
   distinct_matched_count = fields.Integer(missing=0)
+  # matched_count and distinct_matched_count are estimates with this relative standard error when approximate
+  approximate = fields.Boolean(missing=False)
+  distinct_error_bound = fields.Float(missing=0)
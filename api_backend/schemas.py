@@ -1,5 +1,4 @@
 import pytz
-import re
 from datetime import datetime
 from marshmallow import (
   Schema,
@@ -13,10 +12,13 @@ from marshmallow import (
 )
 from bson import ObjectId
 from api_backend.utils.marshmallow_helpers import serialize_fields_Field
+from api_backend.utils.mongo_helpers import MongoIndex
+from api_backend.utils.phone_helpers import normalize_phone
 from constants import (
   AuthEventTypes,
   DataTargets,
   ImportErrorTypes,
+  PromotionModes,
   RoomLayouts,
   TaskStates,
   TaskTypes,
@@ -65,6 +67,24 @@ class HeartBeatSchema(Schema):
   uptime = fields.DefaultUTCDateTime()
   version = fields.String()
 
+class MongoPoolSchema(Schema):
+  address = fields.String(metadata={ "example": "127.0.0.1:27017" })
+  open_connections = fields.Integer()
+  in_use = fields.Integer()
+  connections_created = fields.Integer()
+  connections_closed = fields.Integer()
+  checked_out = fields.Integer()
+  checked_in = fields.Integer()
+  checkout_failed = fields.Integer()
+  pool_cleared = fields.Integer()
+
+class MongoPoolStatsSchema(Schema):
+  # counters of the answering process only, e.g. one gunicorn worker
+  pid = fields.Integer()
+  max_pool_size = fields.Integer()
+  min_pool_size = fields.Integer()
+  pools = fields.List(fields.Nested(MongoPoolSchema))
+
 # base schema for all mongo documents using objectId
 class MongoDefaultDocumentSchema(Schema):
   _id = fields.ObjectId()
@@ -131,6 +151,17 @@ class PasswordRequestRequestSchema(MongoDefaultDocumentSchema):
   expired_at = fields.DefaultUTCDateTime()
   validate_user = fields.Boolean(missing=False, default=False)
   fulfilled = fields.Boolean(missing=False, default=False)
+  class MongoMeta:
+    # expired requests are removed by mongo
+    index_list = [MongoIndex({ "expired_at": 1 }, expireAfterSeconds=0)]
+
+class BlacklistJtiSchema(Schema):
+  # _id is the uuid jti stored as binary
+  exp_datetime = fields.DefaultUTCDateTime()
+  created_at = fields.DefaultUTCDateTime()
+  class MongoMeta:
+    # expired tokens are removed by mongo, tokens without expiry are kept
+    index_list = [{ "created_at": 1 }, MongoIndex({ "exp_datetime": 1 }, expireAfterSeconds=0)]
 
 class UserSchema(MongoDefaultDocumentSchema):
   email = fields.Email(allow_none=False, required=True)
@@ -177,6 +208,28 @@ class SystemLogSchema(MongoDefaultDocumentSchema):
       data["event_details"] = serialize_fields_Field(data["event_details"])
     return data
 
+class TaskProgressSchema(Schema):
+  # counters depend on the task type, rates are derived by the reporter
+  rows_read = fields.Integer()
+  rows_total = fields.Integer()
+  rows_written = fields.Integer()
+  rows_suppressed = fields.Integer()
+  drafts_written = fields.Integer()
+  errors_written = fields.Integer()
+  drafts_matched = fields.Integer()
+  promoted = fields.Integer()
+  promotion_mode = fields.String(validate=validate.OneOf(enum_set(PromotionModes)))
+  groups_merged = fields.Integer()
+  documents_removed = fields.Integer()
+  documents_updated = fields.Integer()
+  collection = fields.String()
+  bytes_read = fields.Integer()
+  bytes_total = fields.Integer()
+  bytes_written = fields.Integer()
+  elapsed_seconds = fields.Float()
+  rows_per_second = fields.Float()
+  eta_seconds = fields.Float()
+
 class SchedulerTaskSchema(MongoDefaultDocumentSchema):
   task_type = fields.String(
     validate=validate.OneOf(enum_set(TaskTypes)),
@@ -185,11 +238,31 @@ class SchedulerTaskSchema(MongoDefaultDocumentSchema):
   state = fields.String(validate=validate.OneOf(enum_set(TaskStates)))
   creator_id = fields.ObjectId()
   trial = fields.Integer(missing=0, default=0)
+  priority = fields.Integer(missing=0, default=0)
+  cancel_requested = fields.Boolean(missing=False, default=False)
   params = fields.Field()
   result = fields.Field()
   system_pid = fields.Integer(missing=None)
+  progress = fields.Nested(
+    TaskProgressSchema,
+    metadata={
+      "example": {
+        "rows_read": 12000,
+        "drafts_written": 11800,
+        "errors_written": 35,
+        "bytes_read": 524288,
+        "bytes_total": 1048576,
+        "elapsed_seconds": 6.2,
+        "rows_per_second": 1935.5,
+        "eta_seconds": 6.2,
+      }
+    }
+  )
+  # position an interrupted task resumes from
+  checkpoint = fields.Field()
   created_at = fields.DefaultUTCDateTime(default_timezone=pytz.UTC)
   run_at = fields.DefaultUTCDateTime(default_timezone=pytz.UTC)
+  heartbeat_at = fields.DefaultUTCDateTime(default_timezone=pytz.UTC)
   finished_at = fields.DefaultUTCDateTime(default_timezone=pytz.UTC)
   extra_info = fields.Field(
     metadata={
@@ -222,6 +295,11 @@ class SchedulerTaskSchema(MongoDefaultDocumentSchema):
       }
     }
   )
+  class MongoMeta:
+    index_list = [
+      { "state": 1, "priority": -1, "created_at": 1 },
+      { "state": 1, "creator_id": 1 },
+    ]
   @pre_dump
   def pre_dump_handler(self, data, **kwargs):
     if "extra_info" in data:
@@ -234,17 +312,21 @@ class SchedulerTaskSchema(MongoDefaultDocumentSchema):
 
 class EstateTagSchema(MongoDefaultDocumentSchema):
   name = fields.String()
+  # search keys derived from name, see utils.text_search
+  name_tokens = fields.List(fields.String(), load_only=True)
   description = fields.String()
   is_frequently_used = fields.Boolean()
   class MongoMeta:
-    index_list = [{ "name": 1, "is_frequently_used": 1 }]
+    index_list = [{ "name": 1, "is_frequently_used": 1 }, { "name_tokens": 1 }]
 
 class CustomerTagSchema(MongoDefaultDocumentSchema):
   name = fields.String()
+  # search keys derived from name, see utils.text_search
+  name_tokens = fields.List(fields.String(), load_only=True)
   description = fields.String()
   is_frequently_used = fields.Boolean()
   class MongoMeta:
-    index_list = [{ "name": 1, "is_frequently_used": 1 }]
+    index_list = [{ "name": 1, "is_frequently_used": 1 }, { "name_tokens": 1 }]
 
 class RoomSizeSchema(Schema):
   size_min = fields.Float(metadata={"example": 25})
@@ -252,6 +334,8 @@ class RoomSizeSchema(Schema):
 
 class EstateInfoSchema(MongoDefaultDocumentSchema):
   name = fields.String(missing="")
+  # search keys derived from name, see utils.text_search
+  name_tokens = fields.List(fields.String(), load_only=True)
   construction_company = fields.String(missing="")
   address = fields.String()
   l1_district = fields.String(allow_none=True, missing=None, metadata={ "example": "臺南市" })
@@ -272,6 +356,7 @@ class EstateInfoSchema(MongoDefaultDocumentSchema):
       { "name": 1, "l1_district": 1, "l2_district": 1, "room_layouts": 1, "updated_at": -1 },
       { "name": 1, "l1_district": 1, "l2_district": 1, "room_sizes.size_min": 1, "updated_at": -1 },
       { "name": 1, "l1_district": 1, "l2_district": 1, "estate_tags": 1, "updated_at": -1 },
+      { "name_tokens": 1 },
     ]
   def __arrange_data__(self, data):
     if type(data.get("room_layouts")) is list:
@@ -302,12 +387,18 @@ class CustomerInfoErrorSchema(MongoDefaultDocumentSchema):
 class CustomerInfoSchema(MongoDefaultDocumentSchema):
   estate_info_id = fields.ObjectId()
   name = fields.String(missing="")
+  # search keys derived from name, see utils.text_search
+  name_tokens = fields.List(fields.String(), load_only=True)
   title_pronoun = fields.String(missing="")
   phone = fields.String(
     required=True,
     validate=validate.Regexp("^\+?[\d\s\-().]{7,20}$", error="Invalid phone format."),
     metadata={ "example": "886987654321" },
   )
+  # search keys derived from phone, see utils.phone_helpers
+  phone_digits = fields.String(load_only=True)
+  phone_digits_rev = fields.String(load_only=True)
+  phone_hash = fields.Integer(load_only=True)
   email = fields.String(
     validate=lambda value: validate.Email()(value) if value else True,
     metadata={"example": "alexchiu@bclab.ai"}
@@ -333,15 +424,18 @@ class CustomerInfoSchema(MongoDefaultDocumentSchema):
       { "estate_info_id": 1, "l1_district": 1, "l2_district": 1, "room_sizes.size_min": 1, "updated_at": -1 },
       { "estate_info_id": 1, "l1_district": 1, "l2_district": 1, "customer_tags": 1, "updated_at": -1 },
       { "estate_info_id": 1, "phone": 1, "info_date": -1 },
+      # natural key, one customer per phone and estate
+      MongoIndex({ "estate_info_id": 1, "phone": 1 }, unique=True),
       { "insert_task_id": 1 },
+      { "info_date": -1, "_id": -1 },
+      { "phone_digits": 1 },
+      { "phone_digits_rev": 1 },
+      { "phone_hash": 1 },
+      { "name_tokens": 1 },
     ]
   def __arrange_data__(self, data):
     if type(data.get("phone")) is str:
-      data["phone"] = re.sub(r'\D', '', data["phone"])
-      if len(data["phone"]) == 10 and data["phone"].startswith('09'):
-        data["phone"] = "886%s" % data["phone"][1:]
-      if len(data["phone"]) == 9 and data["phone"][0] == "9":
-        data["phone"] = "886%s" % data["phone"]
+      data["phone"] = normalize_phone(data["phone"])
     if type(data.get("email")) is str:
       data["email"] = data["email"].strip().lower()
     if type(data.get("room_layouts")) is list:
@@ -358,6 +452,13 @@ class CustomerInfoSchema(MongoDefaultDocumentSchema):
 
 class CustomerInfoDraftSchema(CustomerInfoSchema):
   _dirty = fields.Boolean(missing=False)
+  # xlsx row, used to resume an interrupted import
+  _line_number = fields.Integer()
+  class MongoMeta:
+    # drafts are only looked up by import: promotion, discard and the rows after
+    # a resume checkpoint, search indexes would slow down the bulk inserts,
+    # drafts may repeat a phone, they are merged by key on promotion
+    index_list = [{ "insert_task_id": 1, "_line_number": 1 }]
 
 class DistrictInfoSchema(Schema):
   l1_district = fields.String(allow_none=True, missing=None, metadata={ "example": "臺南市" })
@@ -379,6 +480,10 @@ class CustomerBlacklistSchema(MongoDefaultDocumentSchema):
     validate=validate.Regexp("^\+?[\d\s\-().]{7,20}$", error="Invalid phone format."),
     metadata={ "example": "886987654321" },
   )
+  # search keys derived from phone, see utils.phone_helpers
+  phone_digits = fields.String(load_only=True)
+  phone_digits_rev = fields.String(load_only=True)
+  phone_hash = fields.Integer(load_only=True)
   created_at = fields.DefaultUTCDateTime(default_timezone=pytz.UTC)
   updated_at = fields.DefaultUTCDateTime(default_timezone=pytz.UTC)
   creator_id = fields.ObjectId()
@@ -388,6 +493,10 @@ class CustomerBlacklistSchema(MongoDefaultDocumentSchema):
     index_list = [
       { "creator_id": 1, "created_at": -1, "insert_task_id": 1 },
       { "updater_id": 1, "updated_at": -1, "insert_task_id": 1 },
+      MongoIndex({ "phone": 1 }, unique=True),
+      { "phone_digits": 1 },
+      { "phone_digits_rev": 1 },
+      { "phone_hash": 1 },
     ]
 
 class CustomerBlacklistErrorSchema(MongoDefaultDocumentSchema):
@@ -405,3 +514,34 @@ class CustomerBlacklistErrorSchema(MongoDefaultDocumentSchema):
 
 class CustomerBlacklistDraftSchema(CustomerBlacklistSchema):
   _dirty = fields.Boolean(missing=False)
+  # xlsx row, used to resume an interrupted import
+  _line_number = fields.Integer()
+  class MongoMeta:
+    # only looked up by import, see CustomerInfoDraftSchema
+    index_list = [{ "insert_task_id": 1, "_line_number": 1 }]
+
+class EstateCustomerCountSchema(Schema):
+  # _id is the estate_info_id
+  customer_info_count = fields.Integer()
+  class MongoMeta:
+    index_list = [{ "customer_info_count": -1 }]
+
+# collections and the schema declaring their indexes, see `manage.py indexes`
+MONGO_COLLECTION_SCHEMAS = {
+  "twdistricts": TaiwanAdministrativeDistrictSchema,
+  "users": UserSchema,
+  "passwordresetrequests": PasswordRequestRequestSchema,
+  "blacklistjtis": BlacklistJtiSchema,
+  "systemlogs": SystemLogSchema,
+  "bgtasks": SchedulerTaskSchema,
+  "estatetags": EstateTagSchema,
+  "customertags": CustomerTagSchema,
+  "estateinfos": EstateInfoSchema,
+  "customerinfos": CustomerInfoSchema,
+  "customerinfodrafts": CustomerInfoDraftSchema,
+  "customerinfoimporterrors": CustomerInfoErrorSchema,
+  "customerblacklists": CustomerBlacklistSchema,
+  "customerblacklistdrafts": CustomerBlacklistDraftSchema,
+  "customerblacklistimporterrors": CustomerBlacklistErrorSchema,
+  "estatecustomercounts": EstateCustomerCountSchema,
+}
@@ -1,11 +1,11 @@
-import multiprocessing
 import pymongo
 import pytz
-from api_backend.schemas import CustomerInfoErrorSchema
+from api_backend.schemas import CustomerInfoErrorSchema, SchedulerTaskSchema
 from api_backend.services.customer_blacklist import CustomerBlacklistService
 from api_backend.services.customer_info import CustomerInfoService
 from api_backend.services.estate_info import EstateInfoService
-from api_backend.task_function.workers import process_task
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.mongo_helpers import build_mongo_indexes
 import constants
 import os
 import bson
@@ -14,21 +14,85 @@ from config import Config
 from datetime import datetime
 IMPORT_ERROR_DISPLAY_LIMIT = 200
 class BackgroundTaskService():
+  __loaded__ = False
   def __init__(
       self,
-      mongo_client=pymongo.MongoClient(Config.MONGO_MAIN_URI),
+      mongo_client=None,
     ):
     self.upload_folder = Config.FS_UPLOAD_FOLDER_NAME
     self.upload_path = os.path.join(Config.FS_UPLOAD_ROOT, self.upload_folder)
     self.url_pfx = Config.FS_RETURN_UPLOAD_URL_PFX
-    self.mongo_client = mongo_client
+    self.mongo_client = mongo_client or get_mongo_client()
     self.db = self.mongo_client.get_database()
     self.collection = self.db.bgtasks
-    self.estate_service = EstateInfoService()
-    self.customer_info_service = CustomerInfoService()
-    self.customer_blacklist_service = CustomerBlacklistService()
+    self.estate_service = EstateInfoService(mongo_client=self.mongo_client)
+    self.customer_info_service = CustomerInfoService(mongo_client=self.mongo_client)
+    self.customer_blacklist_service = CustomerBlacklistService(mongo_client=self.mongo_client)
     os.makedirs(self.upload_path, exist_ok=True)
+    if not BackgroundTaskService.__loaded__:
+      BackgroundTaskService.__loaded__ = True
+      if Config.MONGO_BUILD_INDEXES_ON_STARTUP:
+        build_mongo_indexes(self.collection, SchedulerTaskSchema.MongoMeta.index_list)
     return
+
+  def queue_task(self, task_entry):
+    # picked up by worker.py in priority order
+    task_entry.setdefault("priority", constants.TASK_TYPE_PRIORITIES.get(task_entry["task_type"], 0))
+    self.collection.insert_one(task_entry)
+
+  def get_queue_stats(self):
+    now = datetime.now(pytz.UTC)
+    active_filter = { "state": { "$in": [constants.TaskStates.pending, constants.TaskStates.running] } }
+    task_type_stats = self.collection.aggregate([
+      { "$match": active_filter },
+      {
+        "$group": {
+          "_id": { "task_type": "$task_type", "state": "$state" },
+          "count": { "$sum": 1 },
+          "oldest_created_at": { "$min": "$created_at" },
+        }
+      },
+    ])
+    creator_stats = self.collection.aggregate([
+      { "$match": active_filter },
+      {
+        "$group": {
+          "_id": "$creator_id",
+          "pending_count": { "$sum": { "$cond": [{ "$eq": ["$state", constants.TaskStates.pending] }, 1, 0] } },
+          "running_count": { "$sum": { "$cond": [{ "$eq": ["$state", constants.TaskStates.running] }, 1, 0] } },
+        }
+      },
+      { "$sort": { "pending_count": -1 } },
+    ])
+    task_types = {}
+    for stat in task_type_stats:
+      task_type, state = stat["_id"]["task_type"], stat["_id"]["state"]
+      entry = task_types.setdefault(task_type, {
+        "task_type": task_type,
+        "priority": constants.TASK_TYPE_PRIORITIES.get(task_type, 0),
+        "pending_count": 0,
+        "running_count": 0,
+        "max_wait_seconds": 0,
+      })
+      entry["%s_count" % state] = stat["count"]
+      oldest_created_at = stat.get("oldest_created_at")
+      if state == constants.TaskStates.pending and oldest_created_at:
+        if oldest_created_at.tzinfo is None:
+          oldest_created_at = pytz.UTC.localize(oldest_created_at)
+        entry["max_wait_seconds"] = (now - oldest_created_at).total_seconds()
+    return {
+      "pending_count": sum(entry["pending_count"] for entry in task_types.values()),
+      "running_count": sum(entry["running_count"] for entry in task_types.values()),
+      "task_types": sorted(task_types.values(), key=lambda entry: -entry["priority"]),
+      "creators": [
+        {
+          "creator_id": stat["_id"],
+          "pending_count": stat["pending_count"],
+          "running_count": stat["running_count"],
+        } for stat in creator_stats
+      ],
+      "max_running_per_creator": Config.BGTASK_MAX_RUNNING_PER_CREATOR,
+    }
   
   def remove_from_fs(self, resource_url: str):
     if not resource_url:
@@ -48,6 +112,7 @@ class BackgroundTaskService():
     user_id,
     import_to_draft_task_id,
     allow_minor_format_errors=False,
+    promotion_mode=constants.PromotionModes.merge,
   ):
     task_entry = {}
     task_id = bson.ObjectId()
@@ -60,6 +125,7 @@ class BackgroundTaskService():
       params = {
         "processed_task_id": import_to_draft_task_id,
         "allow_minor_format_errors": allow_minor_format_errors,
+        "promotion_mode": promotion_mode,
       },
       result = { },
       system_pid = 0,
@@ -67,10 +133,7 @@ class BackgroundTaskService():
       run_at = None,
       finished_at = None,
     )
-    self.collection.insert_one(task_entry)
-    # process task
-    process = multiprocessing.Process(target=process_task, args=(task_id, ))
-    process.start()
+    self.queue_task(task_entry)
     return task_entry
   
   def reject_customer_info_import_task_by_id(
@@ -93,10 +156,7 @@ class BackgroundTaskService():
       run_at = None,
       finished_at = None,
     )
-    self.collection.insert_one(task_entry)
-    # process task
-    process = multiprocessing.Process(target=process_task, args=(task_id, ))
-    process.start()
+    self.queue_task(task_entry)
     return task_entry
   
   def import_customer_xlsx_to_draft(
@@ -142,10 +202,7 @@ class BackgroundTaskService():
       finished_at = None,
       extra_info = { "imported_to_live": False },
     )
-    self.collection.insert_one(task_entry)
-    # process task
-    process = multiprocessing.Process(target=process_task, args=(task_id, ))
-    process.start()
+    self.queue_task(task_entry)
     return task_entry
 
   def export_customer_info_by_filter(
@@ -156,9 +213,10 @@ class BackgroundTaskService():
     task_entry = {}
     task_id = bson.ObjectId()
     timezone_offset = int(query_dto.pop("timezone_offset"))
+    export_format = query_dto.pop("format", None) or constants.ExportFormats.xlsx
     file_dir_final = os.path.join(self.upload_path, str(user_id))
     os.makedirs(file_dir_final, exist_ok=True)
-    file_name = '%s.xlsx' % (str(task_id))
+    file_name = '%s.%s' % (str(task_id), export_format)
     final_file_path = os.path.join(file_dir_final, '%s' % (file_name, ))
     relative_url = os.path.join("/", Config.FS_UPLOAD_FOLDER_NAME, str(user_id), file_name)
     task_entry.update(
@@ -167,17 +225,133 @@ class BackgroundTaskService():
       state = constants.TaskStates.pending,
       creator_id = user_id,
       trial = 0,
-      params = { "filter": query_dto, "timezone_offset": timezone_offset, "fs_path": final_file_path, "rel_url": relative_url },
+      params = {
+        "filter": query_dto,
+        "timezone_offset": timezone_offset,
+        "format": export_format,
+        "fs_path": final_file_path,
+        "rel_url": relative_url,
+      },
       result = {},
       system_pid = 0,
       created_at = datetime.now(pytz.UTC),
       run_at = None,
       finished_at = None,
     )
-    self.collection.insert_one(task_entry)
-    # process task
-    process = multiprocessing.Process(target=process_task, args=(task_id, ))
-    process.start()
+    self.queue_task(task_entry)
+    return task_entry
+
+  def rebuild_search_fields(self, user_id):
+    task_entry = {}
+    task_id = bson.ObjectId()
+    task_entry.update(
+      _id = task_id,
+      task_type = constants.TaskTypes.rebuild_search_fields,
+      state = constants.TaskStates.pending,
+      creator_id = user_id,
+      trial = 0,
+      params = {},
+      result = {},
+      system_pid = 0,
+      created_at = datetime.now(pytz.UTC),
+      run_at = None,
+      finished_at = None,
+    )
+    self.queue_task(task_entry)
+    return task_entry
+
+  def dedup_customer_info(self, user_id):
+    task_entry = {}
+    task_id = bson.ObjectId()
+    task_entry.update(
+      _id = task_id,
+      task_type = constants.TaskTypes.dedup_customer_info,
+      state = constants.TaskStates.pending,
+      creator_id = user_id,
+      trial = 0,
+      params = {},
+      result = {},
+      system_pid = 0,
+      created_at = datetime.now(pytz.UTC),
+      run_at = None,
+      finished_at = None,
+    )
+    self.queue_task(task_entry)
+    return task_entry
+
+  def dedup_customer_blacklist(self, user_id):
+    task_entry = {}
+    task_id = bson.ObjectId()
+    task_entry.update(
+      _id = task_id,
+      task_type = constants.TaskTypes.dedup_customer_blacklist,
+      state = constants.TaskStates.pending,
+      creator_id = user_id,
+      trial = 0,
+      params = {},
+      result = {},
+      system_pid = 0,
+      created_at = datetime.now(pytz.UTC),
+      run_at = None,
+      finished_at = None,
+    )
+    self.queue_task(task_entry)
+    return task_entry
+
+  def cancel_task_by_id(self, user_id, _id, is_admin=False):
+    target = self.collection.find_one({ "_id": _id })
+    if not target:
+      raise werkzeug.exceptions.NotFound()
+    if not is_admin and target.get("creator_id") != user_id:
+      raise werkzeug.exceptions.Forbidden("only the creator or an admin can cancel the task")
+    # a pending task never starts, it may still hold the results of a run
+    # requeued after a lost worker or connection, and its uploaded file
+    canceled = self.collection.find_one_and_update(
+      { "_id": _id, "state": constants.TaskStates.pending },
+      {
+        "$set": {
+          "state": constants.TaskStates.canceled,
+          "cancel_requested": True,
+          "finished_at": datetime.now(pytz.UTC),
+        }
+      },
+      return_document=pymongo.ReturnDocument.AFTER,
+    )
+    if canceled:
+      from api_backend.task_function.workers import cleanup_canceled_task
+      cleanup_result = cleanup_canceled_task(canceled, self.mongo_client)
+      return self.collection.find_one_and_update(
+        { "_id": _id },
+        { "$set": { "result": { "message": "task %s canceled" % _id, "cleanup": cleanup_result } } },
+        return_document=pymongo.ReturnDocument.AFTER,
+      )
+    # a running task stops at its next batch, the worker cleans up partial drafts
+    canceled = self.collection.find_one_and_update(
+      { "_id": _id, "state": constants.TaskStates.running },
+      { "$set": { "cancel_requested": True } },
+      return_document=pymongo.ReturnDocument.AFTER,
+    )
+    if canceled:
+      return canceled
+    raise werkzeug.exceptions.Conflict("task already %s" % target.get("state"))
+
+  def reconcile_stats_counters(self, user_id):
+    task_entry = {}
+    task_id = bson.ObjectId()
+    task_entry.update(
+      _id = task_id,
+      task_type = constants.TaskTypes.reconcile_stats_counters,
+      state = constants.TaskStates.pending,
+      creator_id = user_id,
+      trial = 0,
+      params = {},
+      result = {},
+      system_pid = 0,
+      created_at = datetime.now(pytz.UTC),
+      run_at = None,
+      finished_at = None,
+    )
+    self.queue_task(task_entry)
     return task_entry
 
   def get_task_by_id(self, _id):
@@ -204,6 +378,7 @@ class BackgroundTaskService():
     user_id,
     import_to_draft_task_id,
     allow_minor_format_errors=False,
+    promotion_mode=constants.PromotionModes.merge,
   ):
     task_entry = {}
     task_id = bson.ObjectId()
@@ -216,6 +391,7 @@ class BackgroundTaskService():
       params = {
         "processed_task_id": import_to_draft_task_id,
         "allow_minor_format_errors": allow_minor_format_errors,
+        "promotion_mode": promotion_mode,
       },
       result = { },
       system_pid = 0,
@@ -223,10 +399,7 @@ class BackgroundTaskService():
       run_at = None,
       finished_at = None,
     )
-    self.collection.insert_one(task_entry)
-    # process task
-    process = multiprocessing.Process(target=process_task, args=(task_id, ))
-    process.start()
+    self.queue_task(task_entry)
     return task_entry
   
   def reject_customer_blacklist_import_task_by_id(
@@ -249,10 +422,7 @@ class BackgroundTaskService():
       run_at = None,
       finished_at = None,
     )
-    self.collection.insert_one(task_entry)
-    # process task
-    process = multiprocessing.Process(target=process_task, args=(task_id, ))
-    process.start()
+    self.queue_task(task_entry)
     return task_entry
   
   def import_customer_blacklist_to_draft(
@@ -293,8 +463,5 @@ class BackgroundTaskService():
       finished_at = None,
       extra_info = { "imported_to_live": False },
     )
-    self.collection.insert_one(task_entry)
-    # process task
-    process = multiprocessing.Process(target=process_task, args=(task_id, ))
-    process.start()
+    self.queue_task(task_entry)
     return task_entry
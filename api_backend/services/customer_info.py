@@ -10,30 +10,36 @@ from api_backend.schemas import (
   CustomerInfoSchema,
 )
 from api_backend.dtos.customer_info import default_customer_info_sort_option
-from api_backend.utils.mongo_helpers import build_mongo_index, get_district_query
+from api_backend.services.stats_counters import StatsCounterService
+from api_backend.utils.mongo_helpers import build_mongo_indexes, get_district_query, lookup_collection
+from api_backend.utils.count_helpers import count_matched
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.paging_helpers import query_paged_results
+from api_backend.utils.phone_helpers import PHONE_COUNT_HASH_FIELDS, get_phone_search_fields, get_phone_search_query
+from api_backend.utils.text_search import get_name_search_fields, get_name_search_query
 from config import Config
 
 class CustomerInfoService():
   __loaded__ = False
   def __init__(
     self,
-    mongo_client=pymongo.MongoClient(Config.MONGO_MAIN_URI),
+    mongo_client=None,
   ):
-    self.mongo_client = mongo_client
+    self.mongo_client = mongo_client or get_mongo_client()
     self.db = self.mongo_client.get_database()
     self.collection = self.db.customerinfos
     self.draft_collection = self.db.customerinfodrafts
     self.import_error_collection = self.db.customerinfoimporterrors
     self.customer_tag_collection = self.db.customertags
     self.estate_info_collection = self.db.estateinfos
+    self.customer_blacklist_collection = self.db.customerblacklists
+    self.stats_counter_service = StatsCounterService(mongo_client=self.mongo_client)
     if not CustomerInfoService.__loaded__:
       CustomerInfoService.__loaded__ = True
-      for index in (CustomerInfoSchema.MongoMeta.index_list):
-        build_mongo_index(self.collection, index)
-      for index in CustomerInfoDraftSchema.MongoMeta.index_list:
-        build_mongo_index(self.draft_collection, index)
-      for index in (CustomerInfoErrorSchema.MongoMeta.index_list):
-        build_mongo_index(self.import_error_collection, index)
+      if Config.MONGO_BUILD_INDEXES_ON_STARTUP:
+        build_mongo_indexes(self.collection, CustomerInfoSchema.MongoMeta.index_list)
+        build_mongo_indexes(self.draft_collection, CustomerInfoDraftSchema.MongoMeta.index_list)
+        build_mongo_indexes(self.import_error_collection, CustomerInfoErrorSchema.MongoMeta.index_list)
         
   def __build_match_filter__(self, query_dto):
     match_filter = {}
@@ -41,10 +47,12 @@ class CustomerInfoService():
       pattern = ".*%s.*" % (query_dto["name"], )
       pattern_regex = re.compile(pattern, re.IGNORECASE)
       match_filter["name"] = pattern_regex
+      # indexed token lookup, the regex only filters the matched candidates
+      name_tokens_query = get_name_search_query(query_dto["name"])
+      if name_tokens_query:
+        match_filter["name_tokens"] = name_tokens_query
     if type(query_dto.get("phone")) is str and query_dto["phone"]:
-      pattern = ".*%s.*" % (query_dto["phone"], )
-      pattern_regex = re.compile(pattern, re.IGNORECASE)
-      match_filter["phone"] = pattern_regex
+      match_filter.setdefault("$and", []).append(get_phone_search_query(query_dto["phone"]))
     if type(query_dto.get("email")) is str and query_dto["email"]:
       pattern = ".*%s.*" % (query_dto["email"], )
       pattern_regex = re.compile(pattern, re.IGNORECASE)
@@ -68,38 +76,17 @@ class CustomerInfoService():
       match_filter["customer_tags"] = { "$all": query_dto["customer_tags"] }
     return match_filter
 
-  def count_by_filter(self, query_dto, grouped_fields=["phone"]):
+  def count_by_filter(self, query_dto, grouped_fields=["phone"], approximate=False):
     match_filter = self.__build_match_filter__(query_dto)
-    agg_stages = []
-    if match_filter:
-      agg_stages.append({"$match": match_filter})
-    facet_stage = { "matched_count": [ { "$count": "count" } ] }
-    distinct_flag = type(grouped_fields) is list and len(grouped_fields)
-    if distinct_flag:
-      grouped_fields = [
-        field.strip() if field.strip().startswith("$") else "$" + field.strip()
-        for field in grouped_fields if type(field) is str and field.strip()
-      ]
-      facet_stage["distinct_matched_count"] = [
-        { "$group": { "_id": grouped_fields } },
-        { "$count": "count" },
-      ]
-    agg_stages.append({ "$facet": facet_stage})
-    project_stage = {
-      "matched_count": { "$ifNull": [ { "$arrayElemAt": ["$matched_count.count", 0] }, 0 ] },
-    }
-    if distinct_flag:
-      project_stage["distinct_matched_count"] = {
-        "$ifNull": [ { "$arrayElemAt": ["$distinct_matched_count.count", 0] }, 0 ]
-      }
-    agg_stages.append({ "$project": project_stage})
-
-    results = list(self.collection.aggregate(agg_stages))
-    result = results[0] if results else {}
-    result["grouped_fields"] = grouped_fields if distinct_flag else []
-    if type(result.get("matched_count")) is int and not result.get("distinct_matched_count"):
-      result["distinct_matched_count"] = result["matched_count"]
-    return result
+    return count_matched(
+      self.collection,
+      match_filter,
+      grouped_fields,
+      approximate=approximate,
+      hash_fields=PHONE_COUNT_HASH_FIELDS,
+      # MongoIndex({ "estate_info_id": 1, "phone": 1 }, unique=True)
+      covering_indexes=[{ "estate_info_id": 1, "phone": 1 }],
+    )
 
   def find_by_id(self, _id):
     result = self.collection.find_one({"_id": _id})
@@ -107,7 +94,13 @@ class CustomerInfoService():
       raise werkzeug.exceptions.NotFound
     return result
   
-  def query_export_cursor(self, query_dto, grouped_fields=["phone"]):
+  def query_export_cursor(
+    self,
+    query_dto,
+    grouped_fields=["phone"],
+    batch_size=Config.EXPORT_CURSOR_BATCH_SIZE,
+    exclude_blacklisted=False,
+  ):
     match_filter = self.__build_match_filter__(query_dto)
     agg_stages = []
     if match_filter:
@@ -130,44 +123,51 @@ class CustomerInfoService():
         }
       })
       agg_stages.append({ "$replaceRoot": { "newRoot": "$doc" }})
-    return self.collection.aggregate(agg_stages)
+    if exclude_blacklisted:
+      # anti-join on the indexed blacklist phone, blacklisted rows are replaced
+      # by a tiny `_suppressed` marker so they can be counted without transfer
+      lookup_collection(
+        agg_stages=agg_stages,
+        target_col=self.customer_blacklist_collection.name,
+        local_field="phone",
+        as_field="_blacklist",
+        foreign_field="phone",
+        unwind=False,
+      )
+      agg_stages.append({
+        "$replaceRoot": {
+          "newRoot": {
+            "$cond": [
+              { "$gt": [ { "$size": "$_blacklist" }, 0 ] },
+              { "_suppressed": True },
+              "$$ROOT",
+            ]
+          }
+        }
+      })
+      agg_stages.append({ "$project": { "_blacklist": 0 } })
+    # rows are consumed one by one by the exporter, fetch them in fixed size batches
+    return self.collection.aggregate(agg_stages, allowDiskUse=True, batchSize=batch_size)
 
   def query_by_filter(self, query_dto):
     # paged_result, has_more, matched_count = self.__query_by_filter__(query_dto)
     match_filter = self.__build_match_filter__(query_dto)
-    page_size = query_dto.get("page_size")
-    page_number = query_dto.get("page_number")
     sort_options = query_dto.get("sort_options") or default_customer_info_sort_option
 
-    agg_stages = []
-    matched_count = None
-    if match_filter:
-      agg_stages.append({"$match": match_filter})
-    # check matched count
-    if bool(query_dto.get("count_matched")):
-      matched_count = self.collection.count_documents(match_filter)
-    
+    sort_fields = [("_id", -1)]
     if sort_options.get("field") and sort_options.get("order"):
-      agg_stages.append({ "$sort": { sort_options.get("field"): sort_options.get("order"), "_id": -1 }})
-    
-    agg_stages.append({'$skip': page_size * (page_number-1)})
-    agg_stages.append({'$limit': page_size + 1})
-    results = list(self.collection.aggregate(agg_stages))
-    result = {
-      "results": results[:page_size],
-      "has_more": bool(len(results) > page_size),
-      "page_size": query_dto.get("page_size"),
-      "page_number": query_dto.get("page_number"),
-    }
-    if not matched_count is None:
-      result["matched_count"] = matched_count
-    return result
+      sort_fields.insert(0, (sort_options.get("field"), sort_options.get("order")))
+    return query_paged_results(self.collection, query_dto, match_filter, sort_fields)
 
   def create(self, dto, user_id=None):
     dto["created_at"] = datetime.now(pytz.UTC)
     dto["updated_at"] = datetime.now(pytz.UTC)
     dto["creator_id"] = user_id
     dto["updater_id"] = user_id
+    if type(dto.get("name")) is str:
+      dto.update(get_name_search_fields(dto["name"]))
+    if type(dto.get("phone")) is str:
+      dto.update(get_phone_search_fields(dto["phone"]))
     if type(dto.get("estate_info_id")) is ObjectId:
       if not self.estate_info_collection.find_one({ "_id": dto["estate_info_id"]}):
         raise werkzeug.exceptions.NotFound("estate %s not found" % str(dto["estate_info_id"]))
@@ -181,12 +181,20 @@ class CustomerInfoService():
       tags_diff = provided_tags - found_tags
       if len(tags_diff):
         raise werkzeug.exceptions.NotFound("tags %s not found" % str(tags_diff))
-    inserted_id = self.collection.insert_one(dto).inserted_id
+    try:
+      inserted_id = self.collection.insert_one(dto).inserted_id
+    except pymongo.errors.DuplicateKeyError:
+      raise werkzeug.exceptions.Conflict("duplicated customer phone %s in estate" % (dto.get("phone"), ))
+    self.stats_counter_service.increment_customer_info_count(dto.get("estate_info_id"), 1)
     return self.find_by_id(inserted_id)
   
   def update_by_id(self, _id, dto, user_id=None):
     dto["updated_at"] = datetime.now(pytz.UTC)
     dto["updater_id"] = user_id
+    if type(dto.get("name")) is str:
+      dto.update(get_name_search_fields(dto["name"]))
+    if type(dto.get("phone")) is str:
+      dto.update(get_phone_search_fields(dto["phone"]))
     if type(dto.get("customer_tags")) is list and dto["customer_tags"]:
       found_tags = { 
         tag["_id"] for tag in self.customer_tag_collection.find(
@@ -200,11 +208,18 @@ class CustomerInfoService():
     if type(dto.get("estate_info_id")) is ObjectId:
       if not self.estate_info_collection.find_one({ "_id": dto["estate_info_id"]}):
         raise werkzeug.exceptions.NotFound("estate %s not found" % str(dto["estate_info_id"]))
-    self.collection.find_one_and_update({"_id": _id}, {"$set": dto})
+    try:
+      previous = self.collection.find_one_and_update({"_id": _id}, {"$set": dto})
+    except pymongo.errors.DuplicateKeyError:
+      raise werkzeug.exceptions.Conflict("duplicated customer phone %s in estate" % (dto.get("phone"), ))
+    if previous and "estate_info_id" in dto and previous.get("estate_info_id") != dto["estate_info_id"]:
+      self.stats_counter_service.increment_customer_info_count(previous.get("estate_info_id"), -1)
+      self.stats_counter_service.increment_customer_info_count(dto["estate_info_id"], 1)
     return self.find_by_id(_id)
   
   def delete_by_id(self, _id, user_id=None):
     result = self.collection.find_one_and_delete({"_id": _id})
     if not result:
       raise werkzeug.exceptions.NotFound
+    self.stats_counter_service.increment_customer_info_count(result.get("estate_info_id"), -1)
     return None
@@ -1,24 +1,26 @@
-import pymongo
 import re
 import werkzeug.exceptions
 from api_backend.schemas import CustomerTagSchema
-from api_backend.utils.mongo_helpers import build_mongo_index
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.mongo_helpers import build_mongo_indexes
+from api_backend.utils.paging_helpers import query_paged_results
+from api_backend.utils.text_search import get_name_search_fields, get_name_search_query
 from config import Config
 
 class CustomerTagsService():
   __loaded__ = False
   def __init__(
     self,
-    mongo_client=pymongo.MongoClient(Config.MONGO_MAIN_URI),
+    mongo_client=None,
   ):
-    self.mongo_client = mongo_client
+    self.mongo_client = mongo_client or get_mongo_client()
     self.db = self.mongo_client.get_database()
     self.collection = self.db.customertags
     self.customer_info_collection = self.db.customerinfos
     if not CustomerTagsService.__loaded__:
       CustomerTagsService.__loaded__ = True
-      for index in (CustomerTagSchema.MongoMeta.index_list):
-        build_mongo_index(self.collection, index)
+      if Config.MONGO_BUILD_INDEXES_ON_STARTUP:
+        build_mongo_indexes(self.collection, CustomerTagSchema.MongoMeta.index_list)
 
   def __query_by_filter__(self, query_dto):
     match_filter = {}
@@ -26,21 +28,13 @@ class CustomerTagsService():
       pattern = ".*%s.*" % (query_dto["name"], )
       pattern_regex = re.compile(pattern, re.IGNORECASE)
       match_filter["name"] = pattern_regex
+      # indexed token lookup, the regex only filters the matched candidates
+      name_tokens_query = get_name_search_query(query_dto["name"])
+      if name_tokens_query:
+        match_filter["name_tokens"] = name_tokens_query
     if type(query_dto.get("is_frequently_used")) is bool and query_dto["is_frequently_used"]:
       match_filter["is_frequently_used"] = True
-    page_size = query_dto.get("page_size")
-    page_number = query_dto.get("page_number")
-    agg_stages = []
-    matched_count = None
-    if match_filter:
-      agg_stages.append({"$match": match_filter})
-    # check matched count
-    if bool(query_dto.get("count_matched")):
-      matched_count = self.collection.count_documents(match_filter)
-    agg_stages.append({"$skip": page_size * (page_number - 1)})
-    agg_stages.append({"$limit": page_size + 1})
-    results = list(self.collection.aggregate(agg_stages))
-    return results[:page_size], bool(len(results) > page_size), matched_count
+    return query_paged_results(self.collection, query_dto, match_filter, [("_id", 1)])
 
   def find_by_id(self, _id):
     result = self.collection.find_one({"_id": _id})
@@ -49,20 +43,12 @@ class CustomerTagsService():
     return result
 
   def query_by_filter(self, query_dto):
-    paged_result, has_more, matched_count = self.__query_by_filter__(query_dto)
-    result = {
-      "results": paged_result,
-      "has_more": has_more,
-      "page_size": query_dto.get("page_size"),
-      "page_number": query_dto.get("page_number"),
-    }
-    if not matched_count is None:
-      result["matched_count"] = matched_count
-    return result
+    return self.__query_by_filter__(query_dto)
   
   def create(self, dto, user_id=None):
     if self.collection.find_one({ "name": dto.get("name")}):
       raise werkzeug.exceptions.Conflict("duplicated tag %s" % (dto["name"], ))
+    dto.update(get_name_search_fields(dto.get("name")))
     inserted_id = self.collection.insert_one(dto).inserted_id
     return self.find_by_id(inserted_id)
 
@@ -70,6 +56,7 @@ class CustomerTagsService():
     if type(dto.get("name")) is str:
       if self.collection.find_one({ "name": dto["name"], "_id": { "$ne": _id } }):
         raise werkzeug.exceptions.Conflict("duplicated tag %s" % (dto["name"], ))
+      dto.update(get_name_search_fields(dto["name"]))
     self.collection.find_one_and_update({"_id": _id}, {"$set": dto})
     return self.find_by_id(_id)
     
@@ -79,7 +66,7 @@ class CustomerTagsService():
       raise werkzeug.exceptions.NotFound
     # update customer info tags field
     from api_backend.services.customer_info import CustomerInfoService
-    customer_service = CustomerInfoService()
+    customer_service = CustomerInfoService(mongo_client=self.mongo_client)
     customer_service.collection.update_many(
       { "customer_tags": _id },
       { "$pull": { "customer_tags": _id } },
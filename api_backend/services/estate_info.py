@@ -1,28 +1,32 @@
 from datetime import datetime
-import pymongo
 import pytz
 import re
 import werkzeug.exceptions
 from api_backend.schemas import EstateInfoSchema
 from api_backend.services.customer_info import CustomerInfoService
-from api_backend.utils.mongo_helpers import build_mongo_index, get_district_query
+from api_backend.services.homepage_stats import HomepageStatsService
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.mongo_helpers import build_mongo_indexes, get_district_query
+from api_backend.utils.paging_helpers import query_paged_results
+from api_backend.utils.text_search import get_name_search_fields, get_name_search_query
 from config import Config
 
 class EstateInfoService():
   __loaded__ = False
   def __init__(
     self,
-    mongo_client=pymongo.MongoClient(Config.MONGO_MAIN_URI),
+    mongo_client=None,
   ):
-    self.mongo_client = mongo_client
+    self.mongo_client = mongo_client or get_mongo_client()
     self.db = self.mongo_client.get_database()
     self.collection = self.db.estateinfos
     self.estate_tag_collection = self.db.estatetags
-    self.customer_info_service = CustomerInfoService()
+    self.customer_info_service = CustomerInfoService(mongo_client=self.mongo_client)
+    self.homepage_stats_service = HomepageStatsService(mongo_client=self.mongo_client)
     if not EstateInfoService.__loaded__:
       EstateInfoService.__loaded__ = True
-      for index in (EstateInfoSchema.MongoMeta.index_list):
-        build_mongo_index(self.collection, index)
+      if Config.MONGO_BUILD_INDEXES_ON_STARTUP:
+        build_mongo_indexes(self.collection, EstateInfoSchema.MongoMeta.index_list)
 
   def __query_by_filter__(self, query_dto):
     match_filter = {}
@@ -32,6 +36,10 @@ class EstateInfoService():
       pattern = ".*%s.*" % (query_dto["name"], )
       pattern_regex = re.compile(pattern, re.IGNORECASE)
       match_filter["name"] = pattern_regex
+      # indexed token lookup, the regex only filters the matched candidates
+      name_tokens_query = get_name_search_query(query_dto["name"])
+      if name_tokens_query:
+        match_filter["name_tokens"] = name_tokens_query
     if type(query_dto.get("room_layouts")) is list and query_dto["room_layouts"]:
       match_filter["room_layouts"] = { "$all": query_dto["room_layouts"] }
     if type(query_dto.get("estate_tags")) is list and query_dto["estate_tags"]:
@@ -48,20 +56,9 @@ class EstateInfoService():
         get_district_query(pairs) for pairs in query_dto["districts"]
       ]
 
-    page_size = query_dto.get("page_size")
-    page_number = query_dto.get("page_number")
-    agg_stages = []
-    matched_count = None
-    if match_filter:
-      agg_stages.append({"$match": match_filter})
-    # check matched count
-    if bool(query_dto.get("count_matched")):
-      matched_count = self.collection.count_documents(match_filter)
-    agg_stages.append({"$sort": {"created_at": -1, "_id": 1}})
-    agg_stages.append({"$skip": page_size * (page_number - 1)})
-    agg_stages.append({"$limit": page_size + 1})
-    results = list(self.collection.aggregate(agg_stages))
-    return results[:page_size], bool(len(results) > page_size), matched_count
+    return query_paged_results(
+      self.collection, query_dto, match_filter, [("created_at", -1), ("_id", 1)],
+    )
 
   def find_by_id(self, _id):
     result = self.collection.find_one({"_id": _id})
@@ -70,22 +67,15 @@ class EstateInfoService():
     return result
 
   def query_by_filter(self, query_dto):
-    paged_result, has_more, matched_count = self.__query_by_filter__(query_dto)
-    result = {
-      "results": paged_result,
-      "has_more": has_more,
-      "page_size": query_dto.get("page_size"),
-      "page_number": query_dto.get("page_number"),
-    }
-    if not matched_count is None:
-      result["matched_count"] = matched_count
-    return result
+    return self.__query_by_filter__(query_dto)
   
   def create(self, dto, user_id=None):
     dto["created_at"] = datetime.now(pytz.UTC)
     dto["updated_at"] = datetime.now(pytz.UTC)
     dto["creator_id"] = user_id
     dto["updater_id"] = user_id
+    if type(dto.get("name")) is str:
+      dto.update(get_name_search_fields(dto["name"]))
     if type(dto.get("estate_tags")) is list and dto["estate_tags"]:
       found_tags = { 
         tag["_id"] for tag in self.estate_tag_collection.find(
@@ -97,11 +87,15 @@ class EstateInfoService():
       if len(tags_diff):
         raise werkzeug.exceptions.NotFound("tags %s not found" % str(tags_diff))
     inserted_id = self.collection.insert_one(dto).inserted_id
+    self.customer_info_service.stats_counter_service.increment_total(self.collection.name, 1)
+    self.homepage_stats_service.invalidate_region_rank_snapshot()
     return self.find_by_id(inserted_id)
 
   def update_by_id(self, _id, dto, user_id=None):
     dto["updated_at"] = datetime.now(pytz.UTC)
     dto["updater_id"] = user_id
+    if type(dto.get("name")) is str:
+      dto.update(get_name_search_fields(dto["name"]))
     if type(dto.get("estate_tags")) is list and dto["estate_tags"]:
       found_tags = { 
         tag["_id"] for tag in self.estate_tag_collection.find(
@@ -112,15 +106,19 @@ class EstateInfoService():
       tags_diff = provided_tags - found_tags
       if len(tags_diff):
         raise werkzeug.exceptions.NotFound("tags %s not found" % str(tags_diff))
-    self.collection.find_one_and_update({"_id": _id}, {"$set": dto})
+    previous = self.collection.find_one_and_update({"_id": _id}, {"$set": dto})
+    if previous and "l1_district" in dto and previous.get("l1_district") != dto["l1_district"]:
+      self.homepage_stats_service.invalidate_region_rank_snapshot()
     return self.find_by_id(_id)
     
   def delete_by_id(self, _id, user_id=None):
     result = self.collection.find_one_and_delete({"_id": _id})
     if not result:
       raise werkzeug.exceptions.NotFound
+    self.homepage_stats_service.invalidate_region_rank_snapshot()
     # delete customer info tied to this estate
-    self.customer_info_service.collection.delete_many(
+    deletion_result = self.customer_info_service.collection.delete_many(
       { "estate_info_id": _id }
     )
+    self.customer_info_service.stats_counter_service.remove_estate(_id, deletion_result.deleted_count)
     return None
@@ -1,29 +1,40 @@
-import pymongo
+import time
+import pytz
+from datetime import datetime
+from api_backend.services.stats_counters import StatsCounterService
+from api_backend.utils.mongo_client import get_mongo_client
 from api_backend.utils.mongo_helpers import lookup_collection
 from config import Config
 from constants import TW_REGIONAL_GROUPS
+REGION_RANK_SNAPSHOT_ID = "region_rank_by_estate_count"
 
 class HomepageStatsService():
+  # (expires_at, results) of the region ranking, shared by the process
+  __region_rank_cache__ = None
   def __init__(
     self,
-    mongo_client=pymongo.MongoClient(Config.MONGO_MAIN_URI),
+    mongo_client=None,
+    cache_ttl=Config.HOMEPAGE_STATS_CACHE_TTL,
   ):
-    self.mongo_client = mongo_client
+    self.mongo_client = mongo_client or get_mongo_client()
     self.db = self.mongo_client.get_database()
     self.estate_info_collection = self.db.estateinfos
     self.customer_info_collection = self.db.customerinfos
+    self.snapshot_collection = self.db.homepagestats
+    self.stats_counter_service = StatsCounterService(mongo_client=self.mongo_client)
+    self.cache_ttl = cache_ttl.total_seconds()
 
   def get_estate_customer_info_total_count(self):
+    totals = self.stats_counter_service.get_totals()
     return {
-      "estate_info_count": self.estate_info_collection.count_documents({}),
-      "customer_info_count": self.customer_info_collection.count_documents({}),
+      "estate_info_count": totals[self.estate_info_collection.name],
+      "customer_info_count": totals[self.customer_info_collection.name],
     }
 
   def get_estate_rank_by_customer_info_count(self, query_dto):
     limit = query_dto.get("limit")
+    # top-N of the maintained per-estate counts, an indexed sort
     agg_stages = [
-      { "$match": { "estate_info_id": { "$ne": None } } },
-      { "$group": { "_id": "$estate_info_id", "customer_info_count": { "$sum": 1 } } },
       { "$sort": { "customer_info_count": -1 } },
       { "$limit": limit }
     ]
@@ -33,6 +44,8 @@ class HomepageStatsService():
       local_field="_id",
       as_field="estate_info",
     )
+    # counters of an estate deleted meanwhile, until the next reconcile
+    agg_stages.append({ "$match": { "estate_info": { "$ne": None } } })
     agg_stages.append({
       "$replaceRoot": {
         "newRoot": {
@@ -43,7 +56,7 @@ class HomepageStatsService():
         } 
       }
     })
-    results = list(self.customer_info_collection.aggregate(agg_stages))
+    results = list(self.stats_counter_service.estate_customer_count_collection.aggregate(agg_stages))
     if len(results) < limit:
       remaining_length = limit - len(results)
       pads = self.estate_info_collection.find(
@@ -55,26 +68,70 @@ class HomepageStatsService():
         results.append(item)
     return results
   
-  def get_region_ranked_by_estate_count(self):
+  def compute_region_ranked_by_estate_count(self):
+    # one $group over every district, districts are mapped to regions here
+    district_estate_count_map = {
+      district: 0 for region in TW_REGIONAL_GROUPS for district in region["districts"]
+    }
+    district_estate_aggs = self.estate_info_collection.aggregate([
+      { "$match": { "l1_district": { "$in": list(district_estate_count_map) } } },
+      { "$group": { "_id": "$l1_district", "estate_info_count": { "$sum": 1 } } },
+    ])
+    for agg in district_estate_aggs:
+      district_estate_count_map[agg["_id"]] = int(agg["estate_info_count"] or 0)
+
     results = []
     for region in TW_REGIONAL_GROUPS:
-      district_estate_count_map = { district: 0 for district in region["districts"] }
-      region_estate_aggs = self.estate_info_collection.aggregate([
-        { "$match": { "l1_district": { "$in": region["districts"] } } },
-        { "$group": { "_id": "$l1_district", "estate_info_count": { "$sum": 1 } } },
-      ])
-      for agg in region_estate_aggs:
-        district_estate_count_map[agg["_id"]] = int(agg["estate_info_count"] or 0)
-
       results.append({
         "region_name": region["region_name"],
         "restion_stats": [
-          { "l1_district": item[0], "estate_info_count": item[1] }
-          for item in sorted(
-            district_estate_count_map.items(),
-            key=lambda item: item[1],
+          { "l1_district": district, "estate_info_count": district_estate_count_map[district] }
+          for district in sorted(
+            region["districts"],
+            key=lambda district: district_estate_count_map[district],
             reverse=True,
           )
         ],
       })
     return results
+
+  def refresh_region_rank_snapshot(self):
+    snapshot = self.snapshot_collection.find_one({ "_id": REGION_RANK_SNAPSHOT_ID }, { "version": 1 }) or {}
+    version = snapshot.get("version", 0)
+    results = self.compute_region_ranked_by_estate_count()
+    # an estate write during the computation bumps `version`, so the
+    # snapshot stays stale and the next read computes it again
+    self.snapshot_collection.update_one(
+      { "_id": REGION_RANK_SNAPSHOT_ID },
+      {
+        "$set": {
+          "results": results,
+          "computed_version": version,
+          "computed_at": datetime.now(pytz.UTC),
+        },
+        "$setOnInsert": { "version": version },
+      },
+      upsert=True,
+    )
+    return results
+
+  def invalidate_region_rank_snapshot(self):
+    # called on estate writes, other processes see it once their cache expires
+    self.snapshot_collection.update_one(
+      { "_id": REGION_RANK_SNAPSHOT_ID },
+      { "$inc": { "version": 1 } },
+      upsert=True,
+    )
+    HomepageStatsService.__region_rank_cache__ = None
+
+  def get_region_ranked_by_estate_count(self):
+    cache = HomepageStatsService.__region_rank_cache__
+    if cache and cache[0] > time.monotonic():
+      return cache[1]
+    snapshot = self.snapshot_collection.find_one({ "_id": REGION_RANK_SNAPSHOT_ID })
+    if snapshot and "results" in snapshot and snapshot.get("computed_version") == snapshot.get("version"):
+      results = snapshot["results"]
+    else:
+      results = self.refresh_region_rank_snapshot()
+    HomepageStatsService.__region_rank_cache__ = (time.monotonic() + self.cache_ttl, results)
+    return results
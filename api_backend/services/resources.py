@@ -1,6 +1,6 @@
-import pymongo
 from api_backend.schemas import TaiwanAdministrativeDistrictSchema
-from api_backend.utils.mongo_helpers import build_mongo_index
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.mongo_helpers import build_mongo_indexes
 from config import Config
 
 class ResourceService():
@@ -8,19 +8,26 @@ class ResourceService():
   DISTRICT_MAP = {}
   def __init__(
     self,
-    mongo_client=pymongo.MongoClient(Config.MONGO_MAIN_URI),
+    mongo_client=None,
   ):
-    self.mongo_client = mongo_client
+    self.mongo_client = mongo_client or get_mongo_client()
     self.db = self.mongo_client.get_database()
     self.twdistricts_collection = self.db.twdistricts
     if not ResourceService.__loaded__:
       ResourceService.__loaded__ = True
-      ResourceService.DISTRICT_MAP = { l1["name"]: l1 for l1 in self.twdistricts_collection.find() }
-      for l1 in ResourceService.DISTRICT_MAP.values():
+      if Config.MONGO_BUILD_INDEXES_ON_STARTUP:
+        build_mongo_indexes(self.twdistricts_collection, TaiwanAdministrativeDistrictSchema.MongoMeta.index_list)
+
+  def get_district_map(self):
+    # loaded once per process on first use, not in the constructor: the
+    # controllers construct services at import time, before gunicorn --preload
+    # forks, and the shared client must not connect yet
+    if not ResourceService.DISTRICT_MAP:
+      district_map = { l1["name"]: l1 for l1 in self.twdistricts_collection.find() }
+      for l1 in district_map.values():
         l1["districts"] = { l2["name"]: l2 for l2 in l1["districts"] }
-      for index in (TaiwanAdministrativeDistrictSchema.MongoMeta.index_list):
-        build_mongo_index(self.twdistricts_collection, index)
-    
+      ResourceService.DISTRICT_MAP = district_map
+    return ResourceService.DISTRICT_MAP
 
   def get_l1_tw_administrative_districts(self, query_dto):
     l1_district = query_dto.get("l1_district")
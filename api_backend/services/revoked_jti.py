@@ -0,0 +1,92 @@
+import sys
+import threading
+import time
+import traceback
+import uuid
+import bson
+import pymongo
+import pytz
+from datetime import datetime
+from api_backend.schemas import BlacklistJtiSchema
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.mongo_helpers import build_mongo_indexes
+from config import Config
+
+def __as_utc__(value):
+  if type(value) is datetime and value.tzinfo is None:
+    return value.replace(tzinfo=pytz.UTC)
+  return value
+
+def __jti_key__(value):
+  if type(value) is bson.Binary:
+    value = value.as_uuid()
+  return str(uuid.UUID(str(value)))
+
+class RevokedJtiService():
+  # revoked jti are mirrored in process memory and refreshed incrementally by
+  # `created_at`, so the token check on every request does not hit mongo,
+  # the cache is shared by every instance of the process
+  __loaded__ = False
+  __lock__ = threading.Lock()
+  __revoked__ = {}
+  __watermark__ = None
+  __refreshed_at__ = None
+  def __init__(
+    self,
+    mongo_client=None,
+    refresh_interval=Config.JWT_REVOCATION_REFRESH_INTERVAL,
+    watermark_overlap=Config.JWT_REVOCATION_WATERMARK_OVERLAP,
+  ):
+    self.mongo_client = mongo_client or get_mongo_client()
+    self.db = self.mongo_client.get_database()
+    self.collection = self.db.blacklistjtis
+    self.refresh_interval = refresh_interval.total_seconds()
+    self.watermark_overlap = watermark_overlap
+    if not RevokedJtiService.__loaded__:
+      RevokedJtiService.__loaded__ = True
+      if Config.MONGO_BUILD_INDEXES_ON_STARTUP:
+        build_mongo_indexes(self.collection, BlacklistJtiSchema.MongoMeta.index_list)
+
+  def __refresh__(self):
+    _now = datetime.now(pytz.UTC)
+    watermark = RevokedJtiService.__watermark__
+    if watermark:
+      # the overlap catches entries written by app servers with a late clock
+      query_filter = { "created_at": { "$gte": watermark - self.watermark_overlap } }
+    else:
+      query_filter = { "$or": [ { "exp_datetime": { "$gte": _now } }, { "exp_datetime": None } ] }
+    for entry in self.collection.find(query_filter, { "exp_datetime": 1, "created_at": 1 }):
+      RevokedJtiService.__revoked__[__jti_key__(entry["_id"])] = __as_utc__(entry.get("exp_datetime"))
+      created_at = __as_utc__(entry.get("created_at"))
+      if created_at and (not watermark or created_at > watermark):
+        watermark = created_at
+    RevokedJtiService.__watermark__ = watermark
+    # expired tokens are refused by the jwt checks anyway
+    RevokedJtiService.__revoked__ = {
+      jti: exp_datetime for jti, exp_datetime in RevokedJtiService.__revoked__.items()
+      if not exp_datetime or exp_datetime >= _now
+    }
+
+  def is_revoked(self, jti):
+    with RevokedJtiService.__lock__:
+      refreshed_at = RevokedJtiService.__refreshed_at__
+      if refreshed_at is None or time.monotonic() - refreshed_at >= self.refresh_interval:
+        try:
+          self.__refresh__()
+          RevokedJtiService.__refreshed_at__ = time.monotonic()
+        except pymongo.errors.PyMongoError:
+          print(traceback.format_exc(), file=sys.stderr)
+          # stale cache, ask mongo directly for this token
+          return self.collection.find_one({ "_id": bson.Binary.from_uuid(uuid.UUID(jti)) }) is not None
+      return __jti_key__(jti) in RevokedJtiService.__revoked__
+
+  def revoke(self, jti, exp_datetime):
+    _now = datetime.now(pytz.UTC)
+    self.collection.insert_one({
+      "_id": bson.Binary.from_uuid(uuid.UUID(jti)),
+      "exp_datetime": exp_datetime,
+      "created_at": _now,
+    })
+    # visible to this process right away, other processes pick it up on refresh
+    with RevokedJtiService.__lock__:
+      RevokedJtiService.__revoked__[__jti_key__(jti)] = exp_datetime
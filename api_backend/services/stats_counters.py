@@ -0,0 +1,109 @@
+import pymongo
+from api_backend.schemas import EstateCustomerCountSchema
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.mongo_helpers import build_mongo_indexes
+from config import Config
+RECONCILE_BATCH_SIZE = 1000
+
+class StatsCounterService():
+  # counters maintained on writes so the homepage never scans customerinfos,
+  # `collectioncounters` holds the totals by collection name and
+  # `estatecustomercounts` the customer count of each estate, both can drift
+  # on partial failures and are rebuilt by `reconcile`
+  __loaded__ = False
+  def __init__(
+    self,
+    mongo_client=None,
+  ):
+    self.mongo_client = mongo_client or get_mongo_client()
+    self.db = self.mongo_client.get_database()
+    self.collection = self.db.collectioncounters
+    self.estate_customer_count_collection = self.db.estatecustomercounts
+    self.estate_info_collection = self.db.estateinfos
+    self.customer_info_collection = self.db.customerinfos
+    if not StatsCounterService.__loaded__:
+      StatsCounterService.__loaded__ = True
+      if Config.MONGO_BUILD_INDEXES_ON_STARTUP:
+        build_mongo_indexes(self.estate_customer_count_collection, EstateCustomerCountSchema.MongoMeta.index_list)
+
+  def increment_total(self, collection_name, delta):
+    if delta:
+      self.collection.update_one({ "_id": collection_name }, { "$inc": { "count": delta } }, upsert=True)
+
+  def increment_customer_info_count(self, estate_info_id, delta):
+    if not delta:
+      return
+    if estate_info_id:
+      self.estate_customer_count_collection.update_one(
+        { "_id": estate_info_id },
+        { "$inc": { "customer_info_count": delta } },
+        upsert=True,
+      )
+    self.increment_total(self.customer_info_collection.name, delta)
+
+  def refresh_customer_info_count(self, estate_info_id):
+    # after bulk writes whose inserted count is unknown, e.g. $merge promotion,
+    # the estate is recounted on the (estate_info_id, phone) index
+    customer_info_count = self.customer_info_collection.count_documents({ "estate_info_id": estate_info_id })
+    previous = self.estate_customer_count_collection.find_one_and_update(
+      { "_id": estate_info_id },
+      { "$set": { "customer_info_count": customer_info_count } },
+      upsert=True,
+    ) or {}
+    self.increment_total(
+      self.customer_info_collection.name,
+      customer_info_count - previous.get("customer_info_count", 0),
+    )
+    return customer_info_count
+
+  def remove_estate(self, estate_info_id, deleted_customer_info_count):
+    self.estate_customer_count_collection.delete_one({ "_id": estate_info_id })
+    self.increment_total(self.estate_info_collection.name, -1)
+    self.increment_total(self.customer_info_collection.name, -deleted_customer_info_count)
+
+  def get_totals(self):
+    counters = {
+      counter["_id"]: counter.get("count", 0)
+      for counter in self.collection.find({
+        "_id": { "$in": [self.estate_info_collection.name, self.customer_info_collection.name] }
+      })
+    }
+    for collection in [self.estate_info_collection, self.customer_info_collection]:
+      if collection.name not in counters:
+        # never reconciled, seed the counter once
+        counters[collection.name] = collection.count_documents({})
+        self.collection.update_one(
+          { "_id": collection.name },
+          { "$setOnInsert": { "count": counters[collection.name] } },
+          upsert=True,
+        )
+    return counters
+
+  def reconcile(self):
+    estate_customer_counts = self.customer_info_collection.aggregate([
+      { "$match": { "estate_info_id": { "$ne": None } } },
+      { "$group": { "_id": "$estate_info_id", "customer_info_count": { "$sum": 1 } } },
+    ], allowDiskUse=True)
+    counted_estate_ids = []
+    operations = []
+    for estate_customer_count in estate_customer_counts:
+      counted_estate_ids.append(estate_customer_count["_id"])
+      operations.append(pymongo.ReplaceOne(
+        { "_id": estate_customer_count["_id"] },
+        { "customer_info_count": estate_customer_count["customer_info_count"] },
+        upsert=True,
+      ))
+      if len(operations) >= RECONCILE_BATCH_SIZE:
+        self.estate_customer_count_collection.bulk_write(operations, ordered=False)
+        operations = []
+    if operations:
+      self.estate_customer_count_collection.bulk_write(operations, ordered=False)
+    self.estate_customer_count_collection.delete_many({ "_id": { "$nin": counted_estate_ids } })
+    totals = {}
+    for collection in [self.estate_info_collection, self.customer_info_collection]:
+      totals[collection.name] = collection.count_documents({})
+      self.collection.update_one({ "_id": collection.name }, { "$set": { "count": totals[collection.name] } }, upsert=True)
+    return {
+      "estate_count": len(counted_estate_ids),
+      "totals": totals,
+    }
@@ -1,10 +1,11 @@
 import re
-import pymongo
 import bson
 import pytz
 from datetime import datetime, timedelta
 from api_backend.schemas import SystemLogSchema
-from api_backend.utils.mongo_helpers import build_mongo_index, get_mongo_period, lookup_collection
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.mongo_helpers import build_mongo_indexes, get_mongo_period, lookup_collection
+from api_backend.utils.paging_helpers import query_paged_results
 from constants import AuthEventTypes, DataTargets
 from config import Config
 import werkzeug.exceptions
@@ -13,16 +14,16 @@ class SystemLogService():
   __loaded__ = False
   def __init__(
     self,
-    mongo_client=pymongo.MongoClient(Config.MONGO_MAIN_URI),
+    mongo_client=None,
   ):
-    self.mongo_client = mongo_client
+    self.mongo_client = mongo_client or get_mongo_client()
     self.db = self.mongo_client.get_database()
     self.user_collection = self.db.users
     self.collection = self.db.systemlogs
     if not SystemLogService.__loaded__:
       SystemLogService.__loaded__ = True
-      for index in (SystemLogSchema.MongoMeta.index_list):
-        build_mongo_index(self.collection, index)
+      if Config.MONGO_BUILD_INDEXES_ON_STARTUP:
+        build_mongo_indexes(self.collection, SystemLogSchema.MongoMeta.index_list)
 
   def count_auth_log_events(
     self,
@@ -66,22 +67,12 @@ class SystemLogService():
     if type(query_dto.get("is_frequently_used")) is bool and query_dto["is_frequently_used"]:
       match_filter["is_frequently_used"] = True
 
-    page_size = query_dto.get("page_size")
-    page_number = query_dto.get("page_number")
-    agg_stages = []
-    matched_count = None
-    if match_filter:
-      agg_stages.append({"$match": match_filter})
-    # check matched count
-    if bool(query_dto.get("count_matched")):
-      matched_count = self.collection.count_documents(match_filter)
-
-    agg_stages.append({"$sort": {"_id": sort_order} })
-    lookup_collection(agg_stages, self.user_collection.name, 'user_id', 'user')
-    agg_stages.append({"$skip": page_size * (page_number - 1)})
-    agg_stages.append({"$limit": page_size + 1})
-    results = list(self.collection.aggregate(agg_stages))
-    return results[:page_size], bool(len(results) > page_size), matched_count
+    # user lookup only runs on the rows of the page
+    post_stages = []
+    lookup_collection(post_stages, self.user_collection.name, 'user_id', 'user')
+    return query_paged_results(
+      self.collection, query_dto, match_filter, [("_id", sort_order)], post_stages=post_stages,
+    )
 
   def find_by_id(self, _id):
     result = self.collection.find_one({"_id": _id})
@@ -90,16 +81,7 @@ class SystemLogService():
     return result
 
   def query_by_filter(self, query_dto):
-    paged_result, has_more, matched_count = self.__query_by_filter__(query_dto)
-    result = {
-      "results": paged_result,
-      "has_more": has_more,
-      "page_size": query_dto.get("page_size"),
-      "page_number": query_dto.get("page_number"),
-    }
-    if not matched_count is None:
-      result["matched_count"] = matched_count
-    return result
+    return self.__query_by_filter__(query_dto)
   
   def log_auth_events(
     self, 
@@ -1,5 +1,4 @@
 import re
-import uuid
 import bson
 import pytz
 import pymongo
@@ -7,11 +6,14 @@ import werkzeug.exceptions
 
 from datetime import datetime
 from api_backend.dtos.user import UpdateUserPermissionDto
-from api_backend.schemas import UserPermissionSchema, UserSchema
+from api_backend.schemas import PasswordRequestRequestSchema, UserPermissionSchema, UserSchema
 from api_backend.services.email_notification import EmailService
+from api_backend.services.revoked_jti import RevokedJtiService
 from api_backend.services.system_log import SystemLogService
 from api_backend.utils.auth_utils import generate_salt_string
-from api_backend.utils.mongo_helpers import build_mongo_index
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.mongo_helpers import build_mongo_indexes
+from api_backend.utils.paging_helpers import query_paged_results
 from config import Config
 from passlib.hash import pbkdf2_sha256
 from constants import DataTargets, AuthEventTypes, Permission
@@ -21,19 +23,21 @@ class UserService():
   __loaded__ = False
   def __init__(
     self,
-    mongo_client=pymongo.MongoClient(Config.MONGO_MAIN_URI),
+    mongo_client=None,
   ):
-    self.mongo_client = mongo_client
+    self.mongo_client = mongo_client or get_mongo_client()
     self.db = self.mongo_client.get_database()
     self.collection = self.db.users
     self.chpwd_request_collection = self.db.passwordresetrequests
     self.blacklist_jti_collection = self.db.blacklistjtis
+    self.revoked_jti_service = RevokedJtiService(mongo_client=self.mongo_client)
     self.mail_svc = EmailService()
-    self.log_svc = SystemLogService()
+    self.log_svc = SystemLogService(mongo_client=self.mongo_client)
     if not UserService.__loaded__:
       UserService.__loaded__ = True
-      for index in (UserSchema.MongoMeta.index_list):
-        build_mongo_index(self.collection, index)
+      if Config.MONGO_BUILD_INDEXES_ON_STARTUP:
+        build_mongo_indexes(self.collection, UserSchema.MongoMeta.index_list)
+        build_mongo_indexes(self.chpwd_request_collection, PasswordRequestRequestSchema.MongoMeta.index_list)
   
   def __query_by_filter__(self, query_dto):
     match_filter = {}
@@ -45,35 +49,16 @@ class UserService():
       pattern = ".*%s.*" % (query_dto["email"], )
       pattern_regex = re.compile(pattern, re.IGNORECASE)
       match_filter["email"] = pattern_regex
-    page_size = query_dto.get("page_size")
-    page_number = query_dto.get("page_number")
-    agg_stages = []
-    matched_count = None
-    if match_filter:
-      agg_stages.append({"$match": match_filter})
-    # check matched count
-    if bool(query_dto.get("count_matched")):
-      matched_count = self.collection.count_documents(match_filter)
-    agg_stages.append({"$sort": {"is_admin": -1, "is_valid": -1, "_id": 1}})
-    agg_stages.append({"$skip": page_size * (page_number - 1)})
-    agg_stages.append({"$limit": page_size + 1})
-    results = list(self.collection.aggregate(agg_stages))
-    for result in results:
-      result.update(self.get_permissions_from_user_or_token(result))
-    return results[:page_size], bool(len(results) > page_size), matched_count
+    result = query_paged_results(
+      self.collection, query_dto, match_filter, [("is_admin", -1), ("is_valid", -1), ("_id", 1)],
+    )
+    for user in result["results"]:
+      user.update(self.get_permissions_from_user_or_token(user))
+    return result
   
   # controller functions
   def query_by_filter(self, query_dto):
-    paged_result, has_more, matched_count = self.__query_by_filter__(query_dto)
-    result = {
-      "results": paged_result,
-      "has_more": has_more,
-      "page_size": query_dto.get("page_size"),
-      "page_number": query_dto.get("page_number"),
-    }
-    if not matched_count is None:
-      result["matched_count"] = matched_count
-    return result
+    return self.__query_by_filter__(query_dto)
 
   def get_profile_by_user_id(self, target_user_id):
     target = self.collection.find_one({ "_id": target_user_id })
@@ -201,12 +186,7 @@ class UserService():
     expiration_datetime = datetime.fromtimestamp(expiration_timestamp, tz=pytz.UTC) if expiration_timestamp else None
     _now = datetime.now(pytz.UTC)
     if not expiration_datetime or expiration_datetime > _now:
-      self.blacklist_jti_collection.insert_one({
-        "_id": bson.Binary.from_uuid(uuid.UUID(jti)),
-        "exp_datetime": expiration_datetime,
-        "created_at": datetime.now(pytz.UTC),
-      })
-    self.blacklist_jti_collection.delete_many({"exp_datetime": {"$lt": _now}})
+      self.revoked_jti_service.revoke(jti, expiration_datetime)
     self.log_svc.log_auth_events(user_id, AuthEventTypes.logout)
     return
 
@@ -272,8 +252,10 @@ class UserService():
 
   def reset_password_with_event_id(self, event_id, reset_dto):
     _now = datetime.now(pytz.UTC)
-    self.chpwd_request_collection.delete_many({'expired_at': { '$lt': _now }})
-    challenge_entry = self.chpwd_request_collection.find_one({"_id": event_id, 'fulfilled': False })
+    # the ttl monitor runs once a minute, expired entries may still be there
+    challenge_entry = self.chpwd_request_collection.find_one(
+      {"_id": event_id, 'fulfilled': False, 'expired_at': { '$gt': _now } },
+    )
 
     if not challenge_entry:
       raise werkzeug.exceptions.NotFound()
@@ -1,16 +1,16 @@
 from datetime import datetime
-import pymongo
 import re
 import pytz
 import werkzeug.exceptions
-from config import Config
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.paging_helpers import query_paged_results
 
 class UserRoleService():
   def __init__(
     self,
-    mongo_client=pymongo.MongoClient(Config.MONGO_MAIN_URI),
+    mongo_client=None,
   ):
-    self.mongo_client = mongo_client
+    self.mongo_client = mongo_client or get_mongo_client()
     self.db = self.mongo_client.get_database()
     self.collection = self.db.userroles
 
@@ -20,19 +20,7 @@ class UserRoleService():
       pattern = ".*%s.*" % (query_dto["name"], )
       pattern_regex = re.compile(pattern, re.IGNORECASE)
       match_filter["name"] = pattern_regex
-    page_size = query_dto.get("page_size")
-    page_number = query_dto.get("page_number")
-    agg_stages = []
-    matched_count = None
-    if match_filter:
-      agg_stages.append({"$match": match_filter})
-    # check matched count
-    if bool(query_dto.get("count_matched")):
-      matched_count = self.collection.count_documents(match_filter)
-    agg_stages.append({"$skip": page_size * (page_number - 1)})
-    agg_stages.append({"$limit": page_size + 1})
-    results = list(self.collection.aggregate(agg_stages))
-    return results[:page_size], bool(len(results) > page_size), matched_count
+    return query_paged_results(self.collection, query_dto, match_filter, [("_id", 1)])
 
   def find_by_id(self, _id):
     result = self.collection.find_one({"_id": _id})
@@ -41,16 +29,7 @@ class UserRoleService():
     return result
 
   def query_by_filter(self, query_dto):
-    paged_result, has_more, matched_count = self.__query_by_filter__(query_dto)
-    result = {
-      "results": paged_result,
-      "has_more": has_more,
-      "page_size": query_dto.get("page_size"),
-      "page_number": query_dto.get("page_number"),
-    }
-    if not matched_count is None:
-      result["matched_count"] = matched_count
-    return result
+    return self.__query_by_filter__(query_dto)
   
   def create(self, dto, user_id=None):
     if self.collection.find_one({ "name": dto.get("name") }):
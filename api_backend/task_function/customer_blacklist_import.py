@@ -1,21 +1,31 @@
 from datetime import datetime, timedelta
+import os
 import sys
-import re
-import pymongo
-import openpyxl
 import pytz
 from api_backend.schemas import CustomerBlacklistSchema, CustomerInfoSchema
 from api_backend.services.resources import ResourceService
+from api_backend.task_function.import_helpers import (
+  BATCH_SIZE,
+  CHECKPOINT_ROWS,
+  BatchInserter,
+  QueuedBatchWriter,
+  discard_rows_after_checkpoint,
+  iter_xlsx_rows,
+  promote_drafts,
+  save_import_checkpoint,
+)
+from api_backend.task_function.progress import TaskProgressReporter
+from api_backend.utils.mongo_client import get_mongo_client
 from api_backend.utils.mongo_helpers import validate_object_id
+from api_backend.utils.phone_helpers import get_phone_search_fields, normalize_phone
 from constants import (
   CUSTOMER_BLACKLIST_XLSX_FIELD_HEADER_MAP,
   CUSTOMER_BLACKLIST_XLSX_HEADER_FIELD_MAP,
   ImportErrorTypes,
+  PromotionModes,
   enum_set,
   RoomLayouts,
 )
-from config import Config
-BATCH_SIZE = 200
 
 def create_error_entry(insert_task_id, line_number, field_name, field_header, field_value,error_type):
   result = {
@@ -29,7 +39,7 @@ def create_error_entry(insert_task_id, line_number, field_name, field_header, fi
   print('import error', result, file=sys.stderr)
   return result
 
-def import_customer_blacklist_xlsx_to_draft(task, mongo_client=None):
+def import_customer_blacklist_xlsx_to_draft(task, mongo_client=None, task_collection_name="bgtasks"):
   schema = CustomerBlacklistSchema()
   task_id = task["_id"]
   creator_id = task.get("creator_id")
@@ -39,112 +49,159 @@ def import_customer_blacklist_xlsx_to_draft(task, mongo_client=None):
   file_path = params["fs_path"]
 
   if not mongo_client:
-    mongo_client = pymongo.MongoClient(Config.MONGO_MAIN_URI)
+    mongo_client = get_mongo_client()
+
+  from api_backend.services.customer_blacklist import CustomerBlacklistService
+  customer_blacklist_service = CustomerBlacklistService(mongo_client=mongo_client)
+  progress = TaskProgressReporter(
+    mongo_client.get_database().get_collection(task_collection_name),
+    task_id,
+  )
+  # a re-run resumes after the last checkpoint of the interrupted run
+  checkpoint = task.get("checkpoint") or {}
+  resume_row_number = checkpoint.get("row_number", 1)
+  if checkpoint:
+    discard_rows_after_checkpoint(
+      customer_blacklist_service.draft_collection,
+      customer_blacklist_service.import_error_collection,
+      task_id,
+      resume_row_number,
+    )
+  parse_state = { "rows_read": 0, "bytes_read": 0 }
+  def __on_written__(written_counts):
+    progress.update(
+      rows_read=parse_state["rows_read"],
+      bytes_read=parse_state["bytes_read"],
+      bytes_total=bytes_total,
+      drafts_written=checkpoint.get("drafts_written", 0) + written_counts.get(customer_blacklist_service.draft_collection.name, 0),
+      errors_written=checkpoint.get("errors_written", 0) + written_counts.get(customer_blacklist_service.import_error_collection.name, 0),
+    )
+  # drafts and errors are flushed as batches fill and written by a separate
+  # thread while parsing continues, memory stays bounded
+  writer = QueuedBatchWriter(on_written=__on_written__)
+  writer.start()
+  draft_inserter = BatchInserter(customer_blacklist_service.draft_collection, writer=writer)
+  error_inserter = BatchInserter(customer_blacklist_service.import_error_collection, writer=writer)
 
-  workbook = openpyxl.load_workbook(file_path)
-  worksheet = workbook.active
-  headers = [str(cell.value).strip() for cell in worksheet[1]]
+  bytes_total = os.path.getsize(file_path)
+  rows = iter_xlsx_rows(file_path, read_state=parse_state)
+  headers = [str(value).strip() for value in next(rows, ())]
   # create headers-fields mapping
   column_map = {
     index: CUSTOMER_BLACKLIST_XLSX_HEADER_FIELD_MAP.get(header, None)
     for index, header in enumerate(headers)
   }
-  data_list = []
-  error_list = []
   basic_string_fields = {"name", "phone"}
   row_number = 1
-  empty_row_count = 0
-  for row in worksheet.iter_rows(min_row=2, values_only=True):
-    row_error_list = []
-    row_number += 1
-    data = {
-      "created_at": datetime.now(pytz.UTC),
-      "creator_id": creator_id,
-      "updated_at": datetime.now(pytz.UTC),
-      "updater_id": creator_id,
-      "insert_task_id": task_id,
-    }
-    empty_check_row = [field for field in row if field]
-    if len(empty_check_row) == 0:
-      empty_row_count += 1
-
-    if empty_row_count > 10:
-      break
-    # for each column (field)
-    for index, value in enumerate(row):
-      field_name = column_map.get(index)
-      if not field_name:
+  empty_row_count = checkpoint.get("empty_row_count", 0)
+  checkpoint_row_number = resume_row_number
+  try:
+    for row in rows:
+      if row_number - checkpoint_row_number >= CHECKPOINT_ROWS:
+        save_import_checkpoint(
+          progress,
+          writer,
+          draft_inserter,
+          error_inserter,
+          checkpoint,
+          row_number=row_number,
+          empty_row_count=empty_row_count,
+        )
+        checkpoint_row_number = row_number
+      row_error_list = []
+      row_number += 1
+      parse_state["rows_read"] = row_number - 1
+      if row_number <= resume_row_number:
         continue
-      if field_name in basic_string_fields:
-        data[field_name] = str(value).strip() if value and str(value).strip() else ""
+      if row_number % BATCH_SIZE == 0:
+        progress.check_canceled(rows_read=parse_state["rows_read"], bytes_read=parse_state["bytes_read"])
+      data = {
+        "created_at": datetime.now(pytz.UTC),
+        "creator_id": creator_id,
+        "updated_at": datetime.now(pytz.UTC),
+        "updater_id": creator_id,
+        "insert_task_id": task_id,
+      }
+      empty_check_row = [field for field in row if field]
+      if len(empty_check_row) == 0:
+        empty_row_count += 1
 
-    # check entry has necessary infos
-    if data and not data.get("phone"):
-      row_error_list.append(
-        create_error_entry(
-          insert_task_id=task_id,
-          line_number=row_number,
-          field_name="phone",
-          field_header=CUSTOMER_BLACKLIST_XLSX_FIELD_HEADER_MAP.get("phone"),
-          field_value="",
-          error_type=ImportErrorTypes.missing,
-        )
-      )
-    elif data.get("phone"):
-      # check against schema
-      error_fields = schema.validate(data)
-      __phone_has_error = False
-      for error_field in error_fields:
-        field_value = str(
-          ','.join(str(x) for x in data[error_field])
-          if type(data[error_field]) is list else data[error_field]
-        )
+      if empty_row_count > 10:
+        break
+      # for each column (field)
+      for index, value in enumerate(row):
+        field_name = column_map.get(index)
+        if not field_name:
+          continue
+        if field_name in basic_string_fields:
+          data[field_name] = str(value).strip() if value and str(value).strip() else ""
+
+      # check entry has necessary infos
+      if data and not data.get("phone"):
         row_error_list.append(
           create_error_entry(
             insert_task_id=task_id,
             line_number=row_number,
-            field_name=error_field,
-            field_header=CUSTOMER_BLACKLIST_XLSX_FIELD_HEADER_MAP.get(error_field),
-            field_value=field_value,
-            error_type=ImportErrorTypes.format_error,
+            field_name="phone",
+            field_header=CUSTOMER_BLACKLIST_XLSX_FIELD_HEADER_MAP.get("phone"),
+            field_value="",
+            error_type=ImportErrorTypes.missing,
           )
         )
-        # index field must be correct
-        if error_field == "phone":
-          __phone_has_error = True
-        else:
-          data[error_field] = None
-      error_list += row_error_list
-      if not __phone_has_error:
-        data["_dirty"] = bool(row_error_list)
-        data["phone"] = re.sub(r'\D', '', data["phone"])
-        if len(data["phone"]) == 10 and data["phone"].startswith('09'):
-          data["phone"] = "886%s" % data["phone"][1:]
-        if len(data["phone"]) == 9 and data["phone"][0] == "9":
-          data["phone"] = "886%s" % data["phone"]
-        data_list.append(data)
+      elif data.get("phone"):
+        # check against schema
+        error_fields = schema.validate(data)
+        __phone_has_error = False
+        for error_field in error_fields:
+          field_value = str(
+            ','.join(str(x) for x in data[error_field])
+            if type(data[error_field]) is list else data[error_field]
+          )
+          row_error_list.append(
+            create_error_entry(
+              insert_task_id=task_id,
+              line_number=row_number,
+              field_name=error_field,
+              field_header=CUSTOMER_BLACKLIST_XLSX_FIELD_HEADER_MAP.get(error_field),
+              field_value=field_value,
+              error_type=ImportErrorTypes.format_error,
+            )
+          )
+          # index field must be correct
+          if error_field == "phone":
+            __phone_has_error = True
+          else:
+            data[error_field] = None
+        error_inserter.extend(row_error_list)
+        if not __phone_has_error:
+          data["_dirty"] = bool(row_error_list)
+          data["phone"] = normalize_phone(data["phone"])
+          data.update(get_phone_search_fields(data["phone"]))
+          data["_line_number"] = row_number
+          draft_inserter.append(data)
+  except Exception:
+    # stop the writer thread before giving up, workers are long-lived
+    writer.close(raise_error=False)
+    raise
+  finally:
+    rows.close()
 
-  # insert into draft collection
-  from api_backend.services.customer_blacklist import CustomerBlacklistService
-  customer_blacklist_service = CustomerBlacklistService(mongo_client=mongo_client)
-  i = 0
-  while True:
-    batch = data_list[i:i+BATCH_SIZE]
-    if not batch:
-      break
-    customer_blacklist_service.draft_collection.insert_many(batch)
-    i += BATCH_SIZE
-  i = 0
-  while True:
-    batch = error_list[i:i+BATCH_SIZE]
-    if not batch:
-      break
-    customer_blacklist_service.import_error_collection.insert_many(batch)
-    i += BATCH_SIZE
+  draft_inserter.flush()
+  error_inserter.flush()
+  writer.close()
+  import_count = checkpoint.get("drafts_written", 0) + draft_inserter.inserted_count
+  error_count = checkpoint.get("errors_written", 0) + error_inserter.inserted_count
+  progress.flush(
+    rows_read=parse_state["rows_read"],
+    bytes_read=bytes_total,
+    bytes_total=bytes_total,
+    drafts_written=import_count,
+    errors_written=error_count,
+  )
   return {
-    "message": "%d records processed, %d error found" % (len(data_list), len(error_list)),
-    "error_count": len(error_list),
-    "import_count": len(data_list),
+    "message": "%d records processed, %d error found" % (import_count, error_count),
+    "error_count": error_count,
+    "import_count": import_count,
   }
 
 def import_customer_blacklist_draft_to_live(task, task_collection_name, mongo_client=None):
@@ -152,30 +209,27 @@ def import_customer_blacklist_draft_to_live(task, task_collection_name, mongo_cl
   params = task["params"]
   processed_task_id = validate_object_id(params.get("processed_task_id"))
   allow_minor_format_errors = bool(params.get("allow_minor_format_errors"))
+  promotion_mode = params.get("promotion_mode") or PromotionModes.merge
   if not mongo_client:
-    mongo_client = pymongo.MongoClient(Config.MONGO_MAIN_URI)
+    mongo_client = get_mongo_client()
   from api_backend.services.customer_blacklist import CustomerBlacklistService
   customer_blacklist_service = CustomerBlacklistService(mongo_client=mongo_client)
-  insert_count = 0
-  # bactch moving from draft to live
+  # move from draft to live
   query_filter = { "insert_task_id": processed_task_id }
   if not allow_minor_format_errors:
     query_filter["_dirty"] = { "$ne": True }
-  while True:
-    batch = list(customer_blacklist_service.draft_collection.find(query_filter).limit(BATCH_SIZE))
-    if not batch:
-      break
-    insert_count += len(batch)
-    replace_one_batch = [
-      pymongo.ReplaceOne(
-        { "phone": elem["phone"] },
-        { k: v for k, v in elem.items() if k not in { "_id", "_dirty" } },
-        upsert=True,
-      ) for elem in batch
-    ]
-    customer_blacklist_service.collection.bulk_write(replace_one_batch)
-    ids = [doc["_id"] for doc in batch]
-    customer_blacklist_service.draft_collection.delete_many({"_id": {"$in": ids}})
+  progress = TaskProgressReporter(
+    mongo_client.get_database().get_collection(task_collection_name), task["_id"],
+    rate_counter="promoted",
+  )
+  insert_count = promote_drafts(
+    customer_blacklist_service.draft_collection,
+    customer_blacklist_service.collection,
+    query_filter,
+    ["phone"],
+    promotion_mode=promotion_mode,
+    progress=progress,
+  )
 
   # user approve imported data, remove import errors
   customer_blacklist_service.draft_collection.delete_many(
@@ -199,7 +253,7 @@ def discard_customer_blacklist_xlsx_import_draft(task, mongo_client=None):
   params = task["params"]
   processed_task_id = validate_object_id(params.get("processed_task_id"))
   if not mongo_client:
-    mongo_client = pymongo.MongoClient(Config.MONGO_MAIN_URI)
+    mongo_client = get_mongo_client()
   from api_backend.services.customer_blacklist import CustomerBlacklistService
   customer_blacklist_service = CustomerBlacklistService(mongo_client=mongo_client)
   import_error_deletion_result = customer_blacklist_service.import_error_collection.delete_many(
@@ -0,0 +1,86 @@
+from datetime import datetime
+import pymongo
+from api_backend.services.stats_counters import StatsCounterService
+from api_backend.task_function.import_helpers import BATCH_SIZE
+from api_backend.task_function.progress import TaskProgressReporter
+from api_backend.utils.mongo_client import get_mongo_client
+
+# list fields merged as a set, other fields are filled when empty
+MERGED_LIST_FIELDS = ["customer_tags", "room_layouts"]
+EMPTY_VALUES = [None, "", []]
+
+def merge_duplicated_documents(documents):
+  # the latest updated document is kept, older ones only fill its gaps
+  documents = sorted(
+    documents,
+    key=lambda doc: (doc.get("updated_at") or doc.get("created_at") or datetime.min, doc["_id"]),
+    reverse=True,
+  )
+  merged = dict(documents[0])
+  for document in documents[1:]:
+    for key, value in document.items():
+      if key in MERGED_LIST_FIELDS:
+        merged[key] = sorted(set(merged.get(key) or []) | set(value or []))
+      elif merged.get(key) in EMPTY_VALUES and value not in EMPTY_VALUES:
+        merged[key] = value
+  return merged
+
+def dedup_collection(collection, key_fields, progress=None):
+  duplicated_groups = collection.aggregate([
+    {
+      "$group": {
+        "_id": { field: "$%s" % field for field in key_fields },
+        "ids": { "$push": "$_id" },
+        "count": { "$sum": 1 },
+      }
+    },
+    { "$match": { "count": { "$gt": 1 } } },
+  ], allowDiskUse=True)
+  merged_count = 0
+  removed_count = 0
+  operations = []
+  for group in duplicated_groups:
+    merged = merge_duplicated_documents(list(collection.find({ "_id": { "$in": group["ids"] } })))
+    removed_ids = [_id for _id in group["ids"] if _id != merged["_id"]]
+    operations.append(pymongo.ReplaceOne({ "_id": merged["_id"] }, merged))
+    operations.append(pymongo.DeleteMany({ "_id": { "$in": removed_ids } }))
+    merged_count += 1
+    removed_count += len(removed_ids)
+    if len(operations) >= BATCH_SIZE:
+      collection.bulk_write(operations, ordered=False)
+      operations = []
+      if progress:
+        progress.check_canceled(groups_merged=merged_count, documents_removed=removed_count)
+  if operations:
+    collection.bulk_write(operations, ordered=False)
+  if progress:
+    progress.flush(groups_merged=merged_count, documents_removed=removed_count)
+  return merged_count, removed_count
+
+def dedup_customer_info(task, mongo_client=None, task_collection_name="bgtasks"):
+  if not mongo_client:
+    mongo_client = get_mongo_client()
+  db = mongo_client.get_database()
+  progress = TaskProgressReporter(db.get_collection(task_collection_name), task["_id"], rate_counter="groups_merged")
+  merged_count, removed_count = dedup_collection(
+    db.customerinfos, ["estate_info_id", "phone"], progress=progress,
+  )
+  if removed_count:
+    StatsCounterService(mongo_client=mongo_client).reconcile()
+  return {
+    "message": "%d duplicated customers merged, %d documents removed" % (merged_count, removed_count),
+    "merged_count": merged_count,
+    "removed_count": removed_count,
+  }
+
+def dedup_customer_blacklist(task, mongo_client=None, task_collection_name="bgtasks"):
+  if not mongo_client:
+    mongo_client = get_mongo_client()
+  db = mongo_client.get_database()
+  progress = TaskProgressReporter(db.get_collection(task_collection_name), task["_id"], rate_counter="groups_merged")
+  merged_count, removed_count = dedup_collection(db.customerblacklists, ["phone"], progress=progress)
+  return {
+    "message": "%d duplicated blacklist phones merged, %d documents removed" % (merged_count, removed_count),
+    "merged_count": merged_count,
+    "removed_count": removed_count,
+  }
@@ -1,43 +1,70 @@
-import pymongo
-from api_backend.services.customer_blacklist import CustomerBlacklistService
+import os
 from api_backend.services.customer_info import CustomerInfoService
+from api_backend.task_function.export_writers import create_export_writer
+from api_backend.task_function.progress import TaskProgressReporter
+from api_backend.utils.mongo_client import get_mongo_client
 from config import Config
-from openpyxl import Workbook
 
-from constants import CUSTOMER_XLSX_EXPORT_FIELD_HEADER_MAP
+from constants import CUSTOMER_XLSX_EXPORT_FIELD_HEADER_MAP, ExportFormats
 BATCH_SIZE = 200
 
-def export_customer_xlsx(task, mongo_client=None):
+def export_customer_xlsx(task, mongo_client=None, task_collection_name="bgtasks"):
   # load task parameters
   params = task["params"]
   file_path = params["fs_path"]
   filter = params["filter"]
+  export_format = params.get("format") or ExportFormats.xlsx
+  batch_size = Config.EXPORT_CURSOR_BATCH_SIZE
   if not mongo_client:
-    mongo_client = pymongo.MongoClient(Config.MONGO_MAIN_URI)
+    mongo_client = get_mongo_client()
 
   customer_info_service = CustomerInfoService(mongo_client=mongo_client)
-  customer_blacklist_service = CustomerBlacklistService(mongo_client=mongo_client)
-  blacklist_phones = set(
-    entry.get("phone")
-    for entry in customer_blacklist_service.collection.find({})
+  progress = TaskProgressReporter(
+    mongo_client.get_database().get_collection(task_collection_name), task["_id"],
+  )
+  export_cursor = customer_info_service.query_export_cursor(
+    filter,
+    batch_size=batch_size,
+    exclude_blacklisted=True,
   )
-  export_cursor = customer_info_service.query_export_cursor(filter)
 
   # start writing
-  wb = Workbook()
-  ws = wb.active
-  ws.title = "Contacts"
-  ws.append(list(CUSTOMER_XLSX_EXPORT_FIELD_HEADER_MAP.values()))
+  writer = create_export_writer(
+    export_format,
+    file_path,
+    list(CUSTOMER_XLSX_EXPORT_FIELD_HEADER_MAP.values()),
+  )
   
-  i = 0
-  for entry in export_cursor:
-    i += 1
-    if entry.get("phone") not in blacklist_phones:
-      ws.append([entry[field] for field in CUSTOMER_XLSX_EXPORT_FIELD_HEADER_MAP])
+  export_count = 0
+  suppressed_count = 0
+  try:
+    for entry in export_cursor:
+      progress.check_canceled(rows_read=export_count + suppressed_count, rows_written=export_count, rows_suppressed=suppressed_count)
+      if entry.get("_suppressed"):
+        suppressed_count += 1
+        continue
+      export_count += 1
+      writer.append([entry[field] for field in CUSTOMER_XLSX_EXPORT_FIELD_HEADER_MAP])
+    # Save the file
+    writer.close()
+  except Exception:
+    # canceled or failed, no partial file is left for download
+    writer.abort()
+    if os.path.exists(file_path):
+      os.remove(file_path)
+    raise
+  finally:
+    export_cursor.close()
 
-  # Save the workbook
-  wb.save(file_path)
+  progress.flush(
+    rows_read=export_count + suppressed_count,
+    rows_written=export_count,
+    rows_suppressed=suppressed_count,
+    bytes_written=os.path.getsize(file_path),
+  )
   return {
-    "message": "%d records exported" % (i,),
-    "export_count": i,
+    "message": "%d records exported, %d blacklisted records suppressed" % (export_count, suppressed_count),
+    "export_count": export_count,
+    "suppressed_count": suppressed_count,
+    "format": export_format,
   }
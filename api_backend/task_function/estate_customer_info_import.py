@@ -1,21 +1,34 @@
 from datetime import datetime, timedelta
+import os
 import sys
-import re
-import pymongo
-import openpyxl
 import pytz
 from api_backend.schemas import CustomerInfoSchema
 from api_backend.services.resources import ResourceService
+from api_backend.task_function.import_helpers import (
+  BATCH_SIZE,
+  CHECKPOINT_ROWS,
+  BatchInserter,
+  ChunkedRowParser,
+  QueuedBatchWriter,
+  discard_rows_after_checkpoint,
+  iter_xlsx_rows,
+  promote_drafts,
+  save_import_checkpoint,
+)
+from api_backend.task_function.progress import TaskProgressReporter
+from api_backend.utils.mongo_client import get_mongo_client
 from api_backend.utils.mongo_helpers import validate_object_id
+from api_backend.utils.phone_helpers import get_phone_search_fields, normalize_phone
+from api_backend.utils.text_search import get_name_search_fields
 from constants import (
   CUSTOMER_XLSX_HEADER_FIELD_MAP,
   CUSTOMER_XLSX_FIELD_HEADER_MAP,
   ImportErrorTypes,
+  PromotionModes,
   enum_set,
   RoomLayouts,
 )
 from config import Config
-BATCH_SIZE = 200
 
 def create_error_entry(insert_task_id, line_number, field_name, field_header, field_value,error_type):
   result = {
@@ -29,242 +42,347 @@ def create_error_entry(insert_task_id, line_number, field_name, field_header, fi
   print('import error', result, file=sys.stderr)
   return result
 
-def import_customer_xlsx_to_draft(task, mongo_client=None):
-  schema = CustomerInfoSchema()
-  task_id = task["_id"]
-  creator_id = task.get("creator_id")
+# lookups of the running import, filled in each parse process by init_customer_row_parser
+__parse_context__ = {}
 
-  # load task parameters
-  params = task["params"]
-  file_path = params["fs_path"]
-  estate_info_id = params["estate_info_id"]
-  timezone_offset = int(params.get("timezone_offset"))
+def init_customer_row_parser(context):
+  # read-only lookups of a parse process, set once instead of pickled with every chunk
+  __parse_context__.clear()
+  __parse_context__.update(context, schema=CustomerInfoSchema())
 
-  if not mongo_client:
-    mongo_client = pymongo.MongoClient(Config.MONGO_MAIN_URI)
+def parse_customer_row_chunk(chunk):
+  return [(row_number,) + parse_customer_row(row_number, row) for row_number, row in chunk]
 
-  workbook = openpyxl.load_workbook(file_path)
-  worksheet = workbook.active
-  headers = [str(cell.value).strip() for cell in worksheet[1]]
-  # create headers-fields mapping
-  column_map = {
-    index: CUSTOMER_XLSX_HEADER_FIELD_MAP.get(header, None)
-    for index, header in enumerate(headers)
-  }
-  data_list = []
-  error_list = []
-  __room_layout_options = enum_set(RoomLayouts)
-  __district_map = ResourceService.DISTRICT_MAP
-  from api_backend.services.customer_tags import CustomerTagsService
-  customer_tag_service = CustomerTagsService(mongo_client=mongo_client)
-  __customer_tag_name_id_map = {
-    cursor["name"]: cursor["_id"]
-    for cursor in customer_tag_service.collection.find({})
-  }
+def parse_customer_row(row_number, row):
+  context = __parse_context__
+  schema = context["schema"]
+  task_id = context["task_id"]
+  creator_id = context["creator_id"]
+  estate_info_id = context["estate_info_id"]
+  timezone_offset = context["timezone_offset"]
+  column_map = context["column_map"]
+  __room_layout_options = context["room_layout_options"]
+  __district_map = context["district_map"]
+  __customer_tag_name_id_map = context["customer_tag_name_id_map"]
   basic_string_fields = {"name", "title_pronoun", "phone", "l1_district", "l2_district"}
-  row_number = 1
-  empty_row_count = 0
-  for row in worksheet.iter_rows(min_row=2, values_only=True):
-    row_error_list = []
-    row_number += 1
-    data = {
-      "estate_info_id": estate_info_id,
-      "created_at": datetime.now(pytz.UTC),
-      "creator_id": creator_id,
-      "updated_at": datetime.now(pytz.UTC),
-      "updater_id": creator_id,
-      "insert_task_id": task_id,
-    }
-    empty_check_row = [field for field in row if field]
-    if len(empty_check_row) == 0:
-      empty_row_count += 1
-
-    if empty_row_count > 10:
-      break
-    # for each column (field)
-    for index, value in enumerate(row):
-      field_name = column_map.get(index)
-      if not field_name:
-        continue
-      if field_name in basic_string_fields:
-        data[field_name] = str(value).strip() if value and str(value).strip() else ""
-      elif field_name == "email":
-        data[field_name] = str(value).lower().strip() if value and str(value).strip() else ""
-      elif field_name == "room_layouts" if value and str(value).strip() else "":
-        room_layout_set = set(layout.strip() for layout in str(value).split(","))
-        if room_layout_set - __room_layout_options:
+  row_error_list = []
+  data = {
+    "estate_info_id": estate_info_id,
+    "created_at": datetime.now(pytz.UTC),
+    "creator_id": creator_id,
+    "updated_at": datetime.now(pytz.UTC),
+    "updater_id": creator_id,
+    "insert_task_id": task_id,
+  }
+  # for each column (field)
+  for index, value in enumerate(row):
+    field_name = column_map.get(index)
+    if not field_name:
+      continue
+    if field_name in basic_string_fields:
+      data[field_name] = str(value).strip() if value and str(value).strip() else ""
+    elif field_name == "email":
+      data[field_name] = str(value).lower().strip() if value and str(value).strip() else ""
+    elif field_name == "room_layouts" if value and str(value).strip() else "":
+      room_layout_set = set(layout.strip() for layout in str(value).split(","))
+      if room_layout_set - __room_layout_options:
+        row_error_list.append(
+          create_error_entry(
+            insert_task_id=task_id,
+            line_number=row_number,
+            field_name=field_name,
+            field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get(field_name),
+            field_value=", ".join(room_layout_set - __room_layout_options),
+            error_type=ImportErrorTypes.invalid_value,
+          )
+        )
+      data[field_name] = list(room_layout_set.intersection(__room_layout_options))
+    elif field_name == "customer_tags" and value:
+      found_tag_ids = []
+      data[field_name] = found_tag_ids
+      for tag_name in str(value).split(","):
+        tag_name = tag_name.strip()
+        found_tag_id = __customer_tag_name_id_map.get(tag_name)
+        if found_tag_id:
+          found_tag_ids.append(found_tag_id)
+        else:
           row_error_list.append(
             create_error_entry(
               insert_task_id=task_id,
               line_number=row_number,
               field_name=field_name,
               field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get(field_name),
-              field_value=", ".join(room_layout_set - __room_layout_options),
+              field_value=tag_name,
               error_type=ImportErrorTypes.invalid_value,
             )
           )
-        data[field_name] = list(room_layout_set.intersection(__room_layout_options))
-      elif field_name == "customer_tags" and value:
-        found_tag_ids = []
-        data[field_name] = found_tag_ids
-        for tag_name in str(value).split(","):
-          tag_name = tag_name.strip()
-          found_tag_id = __customer_tag_name_id_map.get(tag_name)
-          if found_tag_id:
-            found_tag_ids.append(found_tag_id)
+      found_tag_ids.sort()
+    
+    elif field_name == "info_date":
+      if type(value) is datetime:
+        data[field_name] = value + timedelta(hours=timezone_offset)
+      else:
+        data[field_name] = value
+    elif field_name == "room_sizes" and value and str(value).strip():
+      value = str(value).replace("坪", "")
+      size_ranges = []
+      data[field_name] = size_ranges
+      for size_range in str(value).split(","):
+        try:
+          size_range = size_range.strip()
+          if "-" in size_range:
+            size_min_s, size_max_s = size_range.split("-")
+            size_ranges.append({"size_min": float(size_min_s), "size_max": float(size_max_s)})
           else:
-            row_error_list.append(
-              create_error_entry(
-                insert_task_id=task_id,
-                line_number=row_number,
-                field_name=field_name,
-                field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get(field_name),
-                field_value=tag_name,
-                error_type=ImportErrorTypes.invalid_value,
-              )
-            )
-        found_tag_ids.sort()
-        
-      elif field_name == "info_date":
-        if type(value) is datetime:
-          data[field_name] = value + timedelta(hours=timezone_offset)
-        else:
-          data[field_name] = value
-      elif field_name == "room_sizes" and value and str(value).strip():
-        value = str(value).replace("坪", "")
-        size_ranges = []
-        data[field_name] = size_ranges
-        for size_range in str(value).split(","):
-          try:
-            size_range = size_range.strip()
-            if "-" in size_range:
-              size_min_s, size_max_s = size_range.split("-")
-              size_ranges.append({"size_min": float(size_min_s), "size_max": float(size_max_s)})
-            else:
-              size_ranges.append({"size_min": float(size_range), "size_max": float(size_range)})
-          except:
-            row_error_list.append(
-              create_error_entry(
-                insert_task_id=task_id,
-                line_number=row_number,
-                field_name=field_name,
-                field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get(field_name),
-                field_value=size_range,
-                error_type=ImportErrorTypes.format_error,
-              )
+            size_ranges.append({"size_min": float(size_range), "size_max": float(size_range)})
+        except:
+          row_error_list.append(
+            create_error_entry(
+              insert_task_id=task_id,
+              line_number=row_number,
+              field_name=field_name,
+              field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get(field_name),
+              field_value=size_range,
+              error_type=ImportErrorTypes.format_error,
             )
+          )
 
-    # check entry has necessary infos
-    if data and not data.get("phone"):
-      row_error_list.append(
-        create_error_entry(
-          insert_task_id=task_id,
-          line_number=row_number,
-          field_name="phone",
-          field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get("phone"),
-          field_value="",
-          error_type=ImportErrorTypes.missing,
-        )
+  # check entry has necessary infos
+  if data and not data.get("phone"):
+    row_error_list.append(
+      create_error_entry(
+        insert_task_id=task_id,
+        line_number=row_number,
+        field_name="phone",
+        field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get("phone"),
+        field_value="",
+        error_type=ImportErrorTypes.missing,
       )
-    elif data.get("phone"):
-      # verify district
-      if {"l1_district", "l2_district"}.intersection(data):
-        l1_district = (data.get("l1_district") or "").replace("台", "臺")
-        l2_district = (data.get("l2_district") or "").replace("台", "臺")
-        target_l1 = __district_map.get(l1_district)
-        if target_l1:
-          data["l1_district"] = target_l1["name"]
-          target_l2 = target_l1["districts"].get(l2_district)
-          if target_l2:
-            data["l2_district"] = target_l2["name"]
-          elif not target_l2 and l2_district:
-            data["l2_district"] = None
-            row_error_list.append(
-              create_error_entry(
-                insert_task_id=task_id,
-                line_number=row_number,
-                field_name="l2_district",
-                field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get("l2_district"),
-                field_value=l2_district,
-                error_type=ImportErrorTypes.invalid_value,
-              )
-            )
-        elif not target_l1 and l1_district:
-          data["l1_district"] = None
+    )
+  elif data.get("phone"):
+    # verify district
+    if {"l1_district", "l2_district"}.intersection(data):
+      l1_district = (data.get("l1_district") or "").replace("台", "臺")
+      l2_district = (data.get("l2_district") or "").replace("台", "臺")
+      target_l1 = __district_map.get(l1_district)
+      if target_l1:
+        data["l1_district"] = target_l1["name"]
+        target_l2 = target_l1["districts"].get(l2_district)
+        if target_l2:
+          data["l2_district"] = target_l2["name"]
+        elif not target_l2 and l2_district:
           data["l2_district"] = None
           row_error_list.append(
             create_error_entry(
               insert_task_id=task_id,
               line_number=row_number,
-              field_name="l1_district",
-              field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get("l1_district"),
-              field_value=l1_district,
+              field_name="l2_district",
+              field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get("l2_district"),
+              field_value=l2_district,
               error_type=ImportErrorTypes.invalid_value,
             )
           )
-        else:
-          data["l1_district"] = None
-          data["l2_district"] = None
-      # check against schema
-      error_fields = schema.validate(data)
-      __phone_has_error = False
-      for error_field in error_fields:
-        # already handled
-        if error_field in { "room_layouts" }:
-          continue
-
-        field_value = str(
-          ','.join(str(x) for x in data[error_field])
-          if type(data[error_field]) is list else data[error_field]
-        )
+      elif not target_l1 and l1_district:
+        data["l1_district"] = None
+        data["l2_district"] = None
         row_error_list.append(
           create_error_entry(
             insert_task_id=task_id,
             line_number=row_number,
-            field_name=error_field,
-            field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get(error_field),
-            field_value=field_value,
-            error_type=ImportErrorTypes.format_error,
+            field_name="l1_district",
+            field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get("l1_district"),
+            field_value=l1_district,
+            error_type=ImportErrorTypes.invalid_value,
           )
         )
-        # index field must be correct
-        if error_field == "phone":
-          __phone_has_error = True
-        elif error_field == "info_date":
-          data["info_date"] = datetime.now(pytz.UTC)
-        else:
-          data[error_field] = None
-      error_list += row_error_list
-      if not __phone_has_error:
-        data["_dirty"] = bool(row_error_list)
-        data["phone"] = re.sub(r'\D', '', data["phone"])
-        if len(data["phone"]) == 10 and data["phone"].startswith('09'):
-          data["phone"] = "886%s" % data["phone"][1:]
-        if len(data["phone"]) == 9 and data["phone"][0] == "9":
-          data["phone"] = "886%s" % data["phone"]
-        data_list.append(data)
+      else:
+        data["l1_district"] = None
+        data["l2_district"] = None
+    # check against schema
+    error_fields = schema.validate(data)
+    __phone_has_error = False
+    for error_field in error_fields:
+      # already handled
+      if error_field in { "room_layouts" }:
+        continue
+
+      field_value = str(
+        ','.join(str(x) for x in data[error_field])
+        if type(data[error_field]) is list else data[error_field]
+      )
+      row_error_list.append(
+        create_error_entry(
+          insert_task_id=task_id,
+          line_number=row_number,
+          field_name=error_field,
+          field_header=CUSTOMER_XLSX_FIELD_HEADER_MAP.get(error_field),
+          field_value=field_value,
+          error_type=ImportErrorTypes.format_error,
+        )
+      )
+      # index field must be correct
+      if error_field == "phone":
+        __phone_has_error = True
+      elif error_field == "info_date":
+        data["info_date"] = datetime.now(pytz.UTC)
+      else:
+        data[error_field] = None
+    if not __phone_has_error:
+      data["_dirty"] = bool(row_error_list)
+      data["phone"] = normalize_phone(data["phone"])
+      data.update(get_phone_search_fields(data["phone"]))
+      data.update(get_name_search_fields(data.get("name")))
+      data["_line_number"] = row_number
+      return data, row_error_list
+    return None, row_error_list
+  # the missing phone error of a row was never written, kept as before
+  return None, []
+
+def import_customer_xlsx_to_draft(task, mongo_client=None, task_collection_name="bgtasks"):
+  task_id = task["_id"]
+  creator_id = task.get("creator_id")
+
+  # load task parameters
+  params = task["params"]
+  file_path = params["fs_path"]
+  estate_info_id = params["estate_info_id"]
+  timezone_offset = int(params.get("timezone_offset"))
+
+  if not mongo_client:
+    mongo_client = get_mongo_client()
 
-  # insert into draft collection
   from api_backend.services.customer_info import CustomerInfoService
   customer_info_service = CustomerInfoService(mongo_client=mongo_client)
-  i = 0
-  while True:
-    batch = data_list[i:i+BATCH_SIZE]
-    if not batch:
-      break
-    customer_info_service.draft_collection.insert_many(batch)
-    i += BATCH_SIZE
-  i = 0
-  while True:
-    batch = error_list[i:i+BATCH_SIZE]
-    if not batch:
-      break
-    customer_info_service.import_error_collection.insert_many(batch)
-    i += BATCH_SIZE
+  progress = TaskProgressReporter(
+    mongo_client.get_database().get_collection(task_collection_name),
+    task_id,
+  )
+  # a re-run resumes after the last checkpoint of the interrupted run
+  checkpoint = task.get("checkpoint") or {}
+  resume_row_number = checkpoint.get("row_number", 1)
+  if checkpoint:
+    discard_rows_after_checkpoint(
+      customer_info_service.draft_collection,
+      customer_info_service.import_error_collection,
+      task_id,
+      resume_row_number,
+    )
+  parse_state = { "rows_read": 0, "bytes_read": 0 }
+  def __on_written__(written_counts):
+    progress.update(
+      rows_read=parse_state["rows_read"],
+      bytes_read=parse_state["bytes_read"],
+      bytes_total=bytes_total,
+      drafts_written=checkpoint.get("drafts_written", 0) + written_counts.get(customer_info_service.draft_collection.name, 0),
+      errors_written=checkpoint.get("errors_written", 0) + written_counts.get(customer_info_service.import_error_collection.name, 0),
+    )
+  # drafts and errors are flushed as batches fill and written by a separate
+  # thread while parsing continues, memory stays bounded
+  writer = QueuedBatchWriter(on_written=__on_written__)
+  writer.start()
+  draft_inserter = BatchInserter(customer_info_service.draft_collection, writer=writer)
+  error_inserter = BatchInserter(customer_info_service.import_error_collection, writer=writer)
+
+  bytes_total = os.path.getsize(file_path)
+  rows = iter_xlsx_rows(file_path, read_state=parse_state)
+  headers = [str(value).strip() for value in next(rows, ())]
+  # create headers-fields mapping
+  column_map = {
+    index: CUSTOMER_XLSX_HEADER_FIELD_MAP.get(header, None)
+    for index, header in enumerate(headers)
+  }
+  from api_backend.services.customer_tags import CustomerTagsService
+  customer_tag_service = CustomerTagsService(mongo_client=mongo_client)
+  parse_context = {
+    "task_id": task_id,
+    "creator_id": creator_id,
+    "estate_info_id": estate_info_id,
+    "timezone_offset": timezone_offset,
+    "column_map": column_map,
+    "room_layout_options": enum_set(RoomLayouts),
+    "district_map": ResourceService(mongo_client=mongo_client).get_district_map(),
+    "customer_tag_name_id_map": {
+      cursor["name"]: cursor["_id"]
+      for cursor in customer_tag_service.collection.find({})
+    },
+  }
+  def __on_parsed__(parsed_rows):
+    # chunks come back in submission order, drafts and errors keep the line order
+    for _, data, row_error_list in parsed_rows:
+      error_inserter.extend(row_error_list)
+      if data:
+        draft_inserter.append(data)
+  # rows are validated in chunks, by a process pool when IMPORT_PARSE_PROCESSES > 1
+  parser = ChunkedRowParser(
+    parse_customer_row_chunk,
+    __on_parsed__,
+    processes=Config.IMPORT_PARSE_PROCESSES,
+    initializer=init_customer_row_parser,
+    initargs=(parse_context, ),
+  )
+  chunk_rows = Config.IMPORT_PARSE_CHUNK_ROWS
+  chunk = []
+  row_number = 1
+  empty_row_count = checkpoint.get("empty_row_count", 0)
+  checkpoint_row_number = resume_row_number
+  try:
+    for row in rows:
+      if not chunk and row_number - checkpoint_row_number >= CHECKPOINT_ROWS:
+        parser.drain()
+        save_import_checkpoint(
+          progress,
+          writer,
+          draft_inserter,
+          error_inserter,
+          checkpoint,
+          row_number=row_number,
+          empty_row_count=empty_row_count,
+        )
+        checkpoint_row_number = row_number
+      row_number += 1
+      parse_state["rows_read"] = row_number - 1
+      if row_number <= resume_row_number:
+        continue
+      if row_number % BATCH_SIZE == 0:
+        progress.check_canceled(rows_read=parse_state["rows_read"], bytes_read=parse_state["bytes_read"])
+      empty_check_row = [field for field in row if field]
+      if len(empty_check_row) == 0:
+        empty_row_count += 1
+
+      if empty_row_count > 10:
+        break
+      chunk.append((row_number, row))
+      if len(chunk) >= chunk_rows:
+        parser.submit(chunk)
+        chunk = []
+    if chunk:
+      parser.submit(chunk)
+    parser.drain()
+  except Exception:
+    # stop the parse processes and the writer thread before giving up, workers are long-lived
+    parser.close(cancel_pending=True)
+    writer.close(raise_error=False)
+    raise
+  finally:
+    rows.close()
+  parser.close()
+
+  draft_inserter.flush()
+  error_inserter.flush()
+  writer.close()
+  import_count = checkpoint.get("drafts_written", 0) + draft_inserter.inserted_count
+  error_count = checkpoint.get("errors_written", 0) + error_inserter.inserted_count
+  progress.flush(
+    rows_read=parse_state["rows_read"],
+    bytes_read=bytes_total,
+    bytes_total=bytes_total,
+    drafts_written=import_count,
+    errors_written=error_count,
+  )
   return {
-    "message": "%d records processed, %d error found" % (len(data_list), len(error_list)),
-    "error_count": len(error_list),
-    "import_count": len(data_list),
+    "message": "%d records processed, %d error found" % (import_count, error_count),
+    "error_count": error_count,
+    "import_count": import_count,
   }
 
 def import_customer_draft_to_live(task, task_collection_name, mongo_client=None):
@@ -272,30 +390,31 @@ def import_customer_draft_to_live(task, task_collection_name, mongo_client=None)
   params = task["params"]
   processed_task_id = validate_object_id(params.get("processed_task_id"))
   allow_minor_format_errors = bool(params.get("allow_minor_format_errors"))
+  promotion_mode = params.get("promotion_mode") or PromotionModes.merge
   if not mongo_client:
-    mongo_client = pymongo.MongoClient(Config.MONGO_MAIN_URI)
+    mongo_client = get_mongo_client()
   from api_backend.services.customer_info import CustomerInfoService
   customer_info_service = CustomerInfoService(mongo_client=mongo_client)
-  insert_count = 0
-  # bactch moving from draft to live
+  # move from draft to live
   query_filter = { "insert_task_id": processed_task_id }
   if not allow_minor_format_errors:
     query_filter["_dirty"] = { "$ne": True }
-  while True:
-    batch = list(customer_info_service.draft_collection.find(query_filter).limit(BATCH_SIZE))
-    if not batch:
-      break
-    insert_count += len(batch)
-    replace_one_batch = [
-      pymongo.ReplaceOne(
-        { "estate_info_id": elem["estate_info_id"], "phone": elem["phone"] },
-        { k: v for k, v in elem.items() if k not in { "_id", "_dirty" } },
-        upsert=True,
-      ) for elem in batch
-    ]
-    customer_info_service.collection.bulk_write(replace_one_batch)
-    ids = [doc["_id"] for doc in batch]
-    customer_info_service.draft_collection.delete_many({"_id": {"$in": ids}})
+  estate_info_ids = customer_info_service.draft_collection.distinct("estate_info_id", query_filter)
+  progress = TaskProgressReporter(
+    mongo_client.get_database().get_collection(task_collection_name), task["_id"],
+    rate_counter="promoted",
+  )
+  insert_count = promote_drafts(
+    customer_info_service.draft_collection,
+    customer_info_service.collection,
+    query_filter,
+    ["estate_info_id", "phone"],
+    promotion_mode=promotion_mode,
+    progress=progress,
+  )
+  # promotion replaces existing phones, the new customers are counted afterwards
+  for estate_info_id in estate_info_ids:
+    customer_info_service.stats_counter_service.refresh_customer_info_count(estate_info_id)
 
   # user approve imported data, remove import errors
   customer_info_service.draft_collection.delete_many(
@@ -319,7 +438,7 @@ def discard_customer_xlsx_import_draft(task, mongo_client=None):
   params = task["params"]
   processed_task_id = validate_object_id(params.get("processed_task_id"))
   if not mongo_client:
-    mongo_client = pymongo.MongoClient(Config.MONGO_MAIN_URI)
+    mongo_client = get_mongo_client()
   from api_backend.services.customer_info import CustomerInfoService
   customer_info_service = CustomerInfoService(mongo_client=mongo_client)
   import_error_deletion_result = customer_info_service.import_error_collection.delete_many(
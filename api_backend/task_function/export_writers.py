@@ -0,0 +1,89 @@
+import csv
+import gzip
+from openpyxl import Workbook
+from constants import ExportFormats, enum_set
+PARQUET_ROW_GROUP_SIZE = 50000
+
+class XlsxExportWriter():
+  def __init__(self, file_path, headers):
+    self.file_path = file_path
+    # write-only workbook streams rows to disk so memory stays constant
+    self.wb = Workbook(write_only=True)
+    self.ws = self.wb.create_sheet("Contacts")
+    self.ws.append(headers)
+
+  def append(self, row):
+    self.ws.append(row)
+
+  def close(self):
+    self.wb.save(self.file_path)
+
+  def abort(self):
+    # nothing is written to file_path before the workbook is saved, rows are
+    # streamed to a temporary file of the worksheet which is removed here
+    self.ws.close()
+    worksheet_writer = getattr(self.ws, "_writer", None)
+    if worksheet_writer:
+      worksheet_writer.cleanup()
+
+class CsvExportWriter():
+  def __init__(self, file_path, headers, compress=False):
+    # utf-8 BOM lets excel detect the encoding of chinese headers
+    if compress:
+      self.file = gzip.open(file_path, "wt", encoding="utf-8-sig", newline="")
+    else:
+      self.file = open(file_path, "w", encoding="utf-8-sig", newline="")
+    self.writer = csv.writer(self.file)
+    self.writer.writerow(headers)
+
+  def append(self, row):
+    self.writer.writerow(row)
+
+  def close(self):
+    self.file.close()
+
+  def abort(self):
+    self.file.close()
+
+class ParquetExportWriter():
+  def __init__(self, file_path, headers, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    import pyarrow
+    import pyarrow.parquet
+    self.pyarrow = pyarrow
+    self.headers = headers
+    self.row_group_size = row_group_size
+    self.schema = pyarrow.schema([(header, pyarrow.string()) for header in headers])
+    self.writer = pyarrow.parquet.ParquetWriter(file_path, self.schema, compression="zstd")
+    self.columns = [[] for _ in headers]
+
+  def append(self, row):
+    for column, value in zip(self.columns, row):
+      column.append(None if value is None else str(value))
+    if len(self.columns[0]) >= self.row_group_size:
+      self.flush()
+
+  def flush(self):
+    if not self.columns[0]:
+      return
+    # each flush becomes one row group, only one group is held in memory
+    self.writer.write_table(self.pyarrow.Table.from_arrays(self.columns, schema=self.schema))
+    self.columns = [[] for _ in self.headers]
+
+  def close(self):
+    self.flush()
+    self.writer.close()
+
+  def abort(self):
+    # buffered rows are dropped, the file is removed by the caller
+    self.writer.close()
+
+def create_export_writer(export_format, file_path, headers):
+  if export_format == ExportFormats.xlsx:
+    return XlsxExportWriter(file_path, headers)
+  elif export_format == ExportFormats.csv:
+    return CsvExportWriter(file_path, headers)
+  elif export_format == ExportFormats.csv_gz:
+    return CsvExportWriter(file_path, headers, compress=True)
+  elif export_format == ExportFormats.parquet:
+    return ParquetExportWriter(file_path, headers)
+  raise ValueError("export format should be one of %s" % enum_set(ExportFormats))
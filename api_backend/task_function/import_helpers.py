@@ -0,0 +1,249 @@
+import collections
+import queue
+import threading
+import openpyxl
+import sys
+import traceback
+import pymongo
+from concurrent.futures import ProcessPoolExecutor
+from constants import PromotionModes
+BATCH_SIZE = 200
+MAX_QUEUED_BATCHES = 8
+CHECKPOINT_ROWS = 5000
+MAX_UPSERT_TRIAL = 3
+DUPLICATE_KEY_ERROR_CODE = 11000
+# removed when drafts are promoted to live
+DRAFT_ONLY_FIELDS = ["_id", "_dirty", "_line_number"]
+
+def iter_xlsx_rows(file_path, read_state=None):
+  # read-only mode parses the sheet lazily instead of materializing every cell,
+  # the first yielded row is the header row, `bytes_read` of read_state follows
+  # the position in the compressed file
+  with open(file_path, "rb") as file:
+    workbook = openpyxl.load_workbook(file, read_only=True)
+    try:
+      worksheet = workbook.active
+      # some writers store a wrong sheet dimension, scan rows until the end instead
+      worksheet.reset_dimensions()
+      for row in worksheet.iter_rows(values_only=True):
+        if read_state is not None:
+          read_state["bytes_read"] = file.tell()
+        yield row
+    finally:
+      workbook.close()
+
+class QueuedBatchWriter(threading.Thread):
+  # consumer side of the import pipeline: batches pushed by the parser are
+  # inserted by this thread while parsing goes on, the bounded queue applies
+  # back pressure when mongo is slower than the parser
+  def __init__(self, max_queued_batches=MAX_QUEUED_BATCHES, on_written=None):
+    super().__init__(daemon=True)
+    self.queue = queue.Queue(maxsize=max_queued_batches)
+    self.on_written = on_written
+    self.written_counts = {}
+    self.error = None
+
+  def put(self, collection, documents):
+    if self.error:
+      raise self.error
+    self.queue.put((collection, documents))
+
+  def run(self):
+    while True:
+      item = self.queue.get()
+      try:
+        if item is None:
+          break
+        collection, documents = item
+        # keep draining after a failure so the parser never blocks on a full queue
+        if self.error:
+          continue
+        collection.insert_many(documents, ordered=False)
+        self.written_counts[collection.name] = self.written_counts.get(collection.name, 0) + len(documents)
+        if self.on_written:
+          self.on_written(self.written_counts)
+      except Exception as e:
+        self.error = e
+      finally:
+        self.queue.task_done()
+
+  def drain(self):
+    # wait until every batch queued so far is written
+    self.queue.join()
+    if self.error:
+      raise self.error
+
+  def close(self, raise_error=True):
+    self.queue.put(None)
+    self.join()
+    if self.error and raise_error:
+      raise self.error
+
+class BatchInserter():
+  def __init__(self, collection, batch_size=BATCH_SIZE, writer=None):
+    self.collection = collection
+    self.batch_size = batch_size
+    self.writer = writer
+    self.buffer = []
+    self.flushed_count = 0
+
+  @property
+  def inserted_count(self):
+    if self.writer:
+      return self.writer.written_counts.get(self.collection.name, 0)
+    return self.flushed_count
+
+  def append(self, document):
+    self.buffer.append(document)
+    if len(self.buffer) >= self.batch_size:
+      self.flush()
+
+  def extend(self, documents):
+    for document in documents:
+      self.append(document)
+
+  def flush(self):
+    if not self.buffer:
+      return
+    if self.writer:
+      self.writer.put(self.collection, self.buffer)
+    else:
+      self.collection.insert_many(self.buffer, ordered=False)
+    self.flushed_count += len(self.buffer)
+    self.buffer = []
+
+class ChunkedRowParser():
+  # validates row chunks with parse_chunk, in a process pool when processes > 1
+  # or inline otherwise, parsed chunks are handed to on_parsed in submission
+  # order, at most 2 chunks per process are in flight to bound memory
+  def __init__(self, parse_chunk, on_parsed, processes=0, initializer=None, initargs=()):
+    self.parse_chunk = parse_chunk
+    self.on_parsed = on_parsed
+    self.pending = collections.deque()
+    self.max_pending = max(processes, 1) * 2
+    self.executor = None
+    if processes > 1:
+      self.executor = ProcessPoolExecutor(processes, initializer=initializer, initargs=initargs)
+    elif initializer:
+      initializer(*initargs)
+
+  def submit(self, chunk):
+    if not self.executor:
+      self.on_parsed(self.parse_chunk(chunk))
+      return
+    self.pending.append(self.executor.submit(self.parse_chunk, chunk))
+    while len(self.pending) > self.max_pending:
+      self.on_parsed(self.pending.popleft().result())
+
+  def drain(self):
+    while self.pending:
+      self.on_parsed(self.pending.popleft().result())
+
+  def close(self, cancel_pending=False):
+    if self.executor:
+      self.executor.shutdown(wait=True, cancel_futures=cancel_pending)
+      self.executor = None
+    self.pending.clear()
+
+def save_import_checkpoint(progress, writer, draft_inserter, error_inserter, previous_checkpoint, **position):
+  # pending batches are written first, so every row up to the checkpoint is complete
+  draft_inserter.flush()
+  error_inserter.flush()
+  writer.drain()
+  progress.save_checkpoint(
+    drafts_written=previous_checkpoint.get("drafts_written", 0) + draft_inserter.inserted_count,
+    errors_written=previous_checkpoint.get("errors_written", 0) + error_inserter.inserted_count,
+    **position,
+  )
+
+def discard_rows_after_checkpoint(draft_collection, error_collection, insert_task_id, row_number):
+  # rows after the checkpoint may have been partially written by the interrupted run
+  draft_collection.delete_many({ "insert_task_id": insert_task_id, "_line_number": { "$gt": row_number } })
+  error_collection.delete_many({ "insert_task_id": insert_task_id, "line_number": { "$gt": row_number } })
+
+def bulk_upsert(collection, operations, max_trial=MAX_UPSERT_TRIAL):
+  # unordered upserts on an unique key: when concurrent writers insert the same
+  # new key, the loser fails with a duplicate key error, only those operations
+  # are retried and they now match the existing document
+  for trial in range(max_trial):
+    try:
+      collection.bulk_write(operations, ordered=False)
+      return
+    except pymongo.errors.BulkWriteError as e:
+      write_errors = e.details.get("writeErrors", [])
+      if trial + 1 >= max_trial or any(error["code"] != DUPLICATE_KEY_ERROR_CODE for error in write_errors):
+        raise
+      operations = [operations[error["index"]] for error in write_errors]
+
+def promote_drafts_in_batches(draft_collection, live_collection, query_filter, key_fields, on_promoted=None):
+  promoted_count = 0
+  while True:
+    batch = list(draft_collection.find(query_filter).limit(BATCH_SIZE))
+    if not batch:
+      break
+    bulk_upsert(live_collection, [
+      pymongo.ReplaceOne(
+        { field: elem.get(field) for field in key_fields },
+        { k: v for k, v in elem.items() if k not in DRAFT_ONLY_FIELDS },
+        upsert=True,
+      ) for elem in batch
+    ])
+    draft_collection.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+    promoted_count += len(batch)
+    if on_promoted:
+      on_promoted(promoted_count)
+  return promoted_count
+
+def merge_drafts_to_live(draft_collection, live_collection, query_filter, key_fields):
+  # a single aggregation on the server, documents never go through the app,
+  # `on` fields need an unique index on the live collection
+  draft_collection.aggregate([
+    { "$match": query_filter },
+    { "$unset": DRAFT_ONLY_FIELDS },
+    {
+      "$merge": {
+        "into": live_collection.name,
+        "on": key_fields,
+        "whenMatched": "replace",
+        "whenNotMatched": "insert",
+      }
+    },
+  ], allowDiskUse=True)
+
+def promote_drafts(
+  draft_collection,
+  live_collection,
+  query_filter,
+  key_fields,
+  promotion_mode=PromotionModes.merge,
+  progress=None,
+):
+  # drafts matching query_filter are upserted into the live collection by key,
+  # the caller deletes the remaining drafts of the import afterwards
+  draft_count = draft_collection.count_documents(query_filter)
+  if progress:
+    progress.flush(drafts_matched=draft_count, rows_total=draft_count, promoted=0, promotion_mode=promotion_mode)
+  if promotion_mode == PromotionModes.merge:
+    # a single $merge can't stop halfway, cancel requests are checked before it
+    if progress:
+      progress.check_canceled()
+    try:
+      merge_drafts_to_live(draft_collection, live_collection, query_filter, key_fields)
+      if progress:
+        progress.flush(promoted=draft_count)
+      return draft_count
+    except pymongo.errors.OperationFailure:
+      # e.g. the unique index is not built yet, batches are idempotent upserts
+      print(traceback.format_exc(), file=sys.stderr)
+      if progress:
+        progress.flush(promotion_mode=PromotionModes.batch)
+  promoted_count = promote_drafts_in_batches(
+    draft_collection,
+    live_collection,
+    query_filter,
+    key_fields,
+    on_promoted=(lambda promoted_count: progress.check_canceled(promoted=promoted_count)) if progress else None,
+  )
+  if progress:
+    progress.flush(promoted=promoted_count)
+  return promoted_count
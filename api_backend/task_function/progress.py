@@ -0,0 +1,104 @@
+import sys
+import time
+import threading
+import traceback
+import pymongo
+import pytz
+from datetime import datetime
+from config import Config
+
+class TaskCanceled(Exception):
+  pass
+
+class TaskProgressReporter():
+  # keeps the counters of a running task and mirrors them into
+  # `progress` of its bgtasks document, so clients can poll them,
+  # writes are throttled to one per `min_interval` seconds unless forced
+  def __init__(self, task_col, task_id, rate_counter="rows_read", min_interval=Config.BGTASK_PROGRESS_INTERVAL):
+    self.task_col = task_col
+    self.task_id = task_id
+    self.rate_counter = rate_counter
+    self.min_interval = min_interval
+    self.counters = {}
+    self.started_at = time.monotonic()
+    self.reported_at = None
+    self.cancel_requested = False
+    # the import writer thread reports along with the parser
+    self.lock = threading.Lock()
+
+  def get_metrics(self, now):
+    elapsed = now - self.started_at
+    metrics = { "elapsed_seconds": round(elapsed, 1) }
+    done = self.counters.get(self.rate_counter)
+    if not done or elapsed <= 0:
+      return metrics
+    rate = done / elapsed
+    metrics["rows_per_second"] = round(rate, 1)
+    # bytes give an estimate when the row total is unknown, e.g. xlsx files
+    bytes_read, bytes_total = self.counters.get("bytes_read"), self.counters.get("bytes_total")
+    rows_total = self.counters.get("rows_total")
+    if rows_total:
+      metrics["eta_seconds"] = round(max(rows_total - done, 0) / rate, 1)
+    elif bytes_read and bytes_total:
+      metrics["eta_seconds"] = round(elapsed * max(bytes_total - bytes_read, 0) / bytes_read, 1)
+    return metrics
+
+  def update(self, force=False, **counters):
+    with self.lock:
+      self.counters.update(counters)
+      now = time.monotonic()
+      if not force and self.reported_at is not None and now - self.reported_at < self.min_interval:
+        return
+      self.reported_at = now
+      progress = dict(self.counters, **self.get_metrics(now))
+    # the cancel flag comes back with the write, no extra round trip
+    task = self.task_col.find_one_and_update(
+      { "_id": self.task_id },
+      {
+        "$set": {
+          **{ "progress.%s" % key: value for key, value in progress.items() },
+          "heartbeat_at": datetime.now(pytz.UTC),
+        }
+      },
+      projection={ "cancel_requested": 1 },
+    )
+    self.cancel_requested = bool(task and task.get("cancel_requested"))
+
+  def flush(self, **counters):
+    # final counters of a step, always written
+    self.update(force=True, **counters)
+
+  def check_canceled(self, **counters):
+    # called by task functions between batches, the flag is refreshed at most
+    # once per `min_interval`
+    self.update(**counters)
+    if self.cancel_requested:
+      raise TaskCanceled("task %s canceled" % self.task_id)
+
+  def save_checkpoint(self, **checkpoint):
+    # position a re-run of the task resumes from
+    self.task_col.update_one({ "_id": self.task_id }, { "$set": { "checkpoint": checkpoint } })
+
+class TaskHeartbeat(threading.Thread):
+  # refreshes `heartbeat_at` while the task runs, even during long single
+  # operations, the worker pool requeues running tasks whose heartbeat stopped
+  def __init__(self, task_col, task_id, interval=Config.BGTASK_HEARTBEAT_INTERVAL):
+    super().__init__(daemon=True)
+    self.task_col = task_col
+    self.task_id = task_id
+    self.interval = interval
+    self.stop_event = threading.Event()
+
+  def run(self):
+    while not self.stop_event.wait(self.interval):
+      try:
+        self.task_col.update_one(
+          { "_id": self.task_id },
+          { "$set": { "heartbeat_at": datetime.now(pytz.UTC) } },
+        )
+      except pymongo.errors.PyMongoError:
+        print(traceback.format_exc(), file=sys.stderr)
+
+  def stop(self):
+    self.stop_event.set()
+    self.join()
@@ -0,0 +1,65 @@
+import pymongo
+from api_backend.task_function.import_helpers import BATCH_SIZE
+from api_backend.task_function.progress import TaskProgressReporter
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.phone_helpers import get_phone_search_fields
+from api_backend.utils.text_search import get_name_search_fields
+
+def get_customer_info_search_fields(document):
+  search_fields = get_phone_search_fields(document.get("phone"))
+  search_fields.update(get_name_search_fields(document.get("name")))
+  return search_fields
+
+def get_customer_blacklist_search_fields(document):
+  return get_phone_search_fields(document.get("phone"))
+
+def get_name_only_search_fields(document):
+  return get_name_search_fields(document.get("name"))
+
+# collections holding derived search keys and how to compute them, drafts
+# are included so pending imports are promoted with up to date keys
+SEARCH_FIELD_COLLECTIONS = {
+  "customerinfos": get_customer_info_search_fields,
+  "customerinfodrafts": get_customer_info_search_fields,
+  "customerblacklists": get_customer_blacklist_search_fields,
+  "customerblacklistdrafts": get_customer_blacklist_search_fields,
+  "estateinfos": get_name_only_search_fields,
+  "customertags": get_name_only_search_fields,
+  "estatetags": get_name_only_search_fields,
+}
+
+def rebuild_search_fields(task, mongo_client=None, task_collection_name="bgtasks"):
+  if not mongo_client:
+    mongo_client = get_mongo_client()
+  db = mongo_client.get_database()
+  progress = TaskProgressReporter(db.get_collection(task_collection_name), task["_id"], rate_counter="documents_updated")
+  progress.flush(
+    documents_updated=0,
+    rows_total=sum(db.get_collection(name).estimated_document_count() for name in SEARCH_FIELD_COLLECTIONS),
+  )
+  updated_counts = {}
+  for collection_name, get_search_fields in SEARCH_FIELD_COLLECTIONS.items():
+    collection = db.get_collection(collection_name)
+    updated_count = 0
+    last_id = None
+    # walk the collection in _id order, one bulk write per batch
+    while True:
+      query_filter = { "_id": { "$gt": last_id } } if last_id else {}
+      batch = list(
+        collection.find(query_filter, { "phone": 1, "name": 1 }).sort("_id", pymongo.ASCENDING).limit(BATCH_SIZE)
+      )
+      if not batch:
+        break
+      collection.bulk_write([
+        pymongo.UpdateOne({ "_id": doc["_id"] }, { "$set": get_search_fields(doc) })
+        for doc in batch
+      ], ordered=False)
+      updated_count += len(batch)
+      last_id = batch[-1]["_id"]
+      progress.check_canceled(collection=collection_name, documents_updated=sum(updated_counts.values()) + updated_count)
+    updated_counts[collection_name] = updated_count
+  progress.flush(documents_updated=sum(updated_counts.values()))
+  return {
+    "message": "%d documents updated" % sum(updated_counts.values()),
+    "updated_counts": updated_counts,
+  }
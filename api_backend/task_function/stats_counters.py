@@ -0,0 +1,11 @@
+from api_backend.services.stats_counters import StatsCounterService
+from api_backend.utils.mongo_client import get_mongo_client
+
+def reconcile_stats_counters(task, mongo_client=None):
+  if not mongo_client:
+    mongo_client = get_mongo_client()
+  result = StatsCounterService(mongo_client=mongo_client).reconcile()
+  return {
+    "message": "%d estates counted" % result["estate_count"],
+    **result,
+  }
@@ -1,4 +1,7 @@
 import sys
+import time
+import signal
+import multiprocessing
 import pymongo
 import os
 import pytz
@@ -10,68 +13,117 @@ from api_backend.task_function.estate_customer_info_import import (
   import_customer_draft_to_live,
   import_customer_xlsx_to_draft,
 )
+from api_backend.task_function.dedup import dedup_customer_blacklist, dedup_customer_info
+from api_backend.task_function.progress import TaskCanceled, TaskHeartbeat
+from api_backend.task_function.search_fields import rebuild_search_fields
+from api_backend.task_function.stats_counters import reconcile_stats_counters
+from api_backend.utils.mongo_client import get_mongo_client
 from constants import TaskStates, TaskTypes, enum_set
 from config import Config
-from datetime import datetime
+from datetime import datetime, timedelta
 
-def process_task(task_id, max_retrial=5, collection_name="bgtasks"):
-  mongo_client = pymongo.MongoClient(Config.MONGO_MAIN_URI)    
-  task_col = mongo_client.get_database().get_collection(collection_name)
-  result = None
-  for i in range(max_retrial):
-    task = task_col.find_one_and_update(
-      { "_id": task_id },
-      { 
+def dispatch_task(task, mongo_client, collection_name="bgtasks"):
+  if task["task_type"] == TaskTypes.import_customer_blacklist_xlsx_to_draft:
+    return import_customer_blacklist_xlsx_to_draft(task, mongo_client, collection_name)
+  elif task["task_type"] == TaskTypes.import_customer_blacklist_draft_to_live:
+    return import_customer_blacklist_draft_to_live(task, collection_name, mongo_client)
+  elif task["task_type"] == TaskTypes.discard_customer_blacklist_xlsx_import_draft:
+    return discard_customer_blacklist_xlsx_import_draft(task, mongo_client)
+  elif task["task_type"] == TaskTypes.import_customer_xlsx_to_draft:
+    return import_customer_xlsx_to_draft(task, mongo_client, collection_name)
+  elif task["task_type"] == TaskTypes.import_customer_draft_to_live:
+    return import_customer_draft_to_live(task, collection_name, mongo_client)
+  elif task["task_type"] == TaskTypes.discard_customer_xlsx_import_draft:
+    return discard_customer_xlsx_import_draft(task, mongo_client)
+  elif task["task_type"] == TaskTypes.export_customer_xlsx:
+    return export_customer_xlsx(task, mongo_client, collection_name)
+  elif task["task_type"] == TaskTypes.rebuild_search_fields:
+    return rebuild_search_fields(task, mongo_client, collection_name)
+  elif task["task_type"] == TaskTypes.dedup_customer_info:
+    return dedup_customer_info(task, mongo_client, collection_name)
+  elif task["task_type"] == TaskTypes.dedup_customer_blacklist:
+    return dedup_customer_blacklist(task, mongo_client, collection_name)
+  elif task["task_type"] == TaskTypes.reconcile_stats_counters:
+    return reconcile_stats_counters(task, mongo_client)
+  raise ValueError("task_type should be one of %s" % enum_set(TaskTypes))
+
+# partial results of a canceled task, removed with the discard logic
+CANCELED_TASK_CLEANUPS = {
+  TaskTypes.import_customer_xlsx_to_draft: discard_customer_xlsx_import_draft,
+  TaskTypes.import_customer_blacklist_xlsx_to_draft: discard_customer_blacklist_xlsx_import_draft,
+}
+
+# the uploaded xlsx of an import, the partial output of an export
+CANCELED_TASK_FILE_TYPES = [
+  TaskTypes.import_customer_xlsx_to_draft,
+  TaskTypes.import_customer_blacklist_xlsx_to_draft,
+  TaskTypes.export_customer_xlsx,
+]
+
+def cleanup_canceled_task(task, mongo_client):
+  cleanup_result = {}
+  cleanup = CANCELED_TASK_CLEANUPS.get(task["task_type"])
+  if cleanup:
+    cleanup_result = cleanup({ "params": { "processed_task_id": task["_id"] } }, mongo_client)
+  file_path = (task.get("params") or {}).get("fs_path")
+  if task["task_type"] in CANCELED_TASK_FILE_TYPES and file_path and os.path.exists(file_path):
+    os.remove(file_path)
+    cleanup_result["file_removed"] = file_path
+  return cleanup_result
+
+def run_claimed_task(task, task_col, mongo_client, collection_name="bgtasks"):
+  heartbeat = TaskHeartbeat(task_col, task["_id"])
+  heartbeat.start()
+  try:
+    result = dispatch_task(task, mongo_client, collection_name)
+  except TaskCanceled as e:
+    cleanup_result = cleanup_canceled_task(task, mongo_client)
+    task_col.update_one(
+      { "_id": task["_id"] },
+      {
         "$set": {
-          "state": TaskStates.running,
-          "trial": i + 1,
-          "run_at": datetime.now(pytz.UTC),
-          "system_pid": os.getpid(),
+          "state": TaskStates.canceled,
+          "result": { "message": str(e), "cleanup": cleanup_result },
+          "finished_at": datetime.now(pytz.UTC),
         }
       }
     )
-    try:
-      if task["task_type"] == TaskTypes.import_customer_blacklist_xlsx_to_draft:
-        result = import_customer_blacklist_xlsx_to_draft(task, mongo_client)
-        break
-      elif task["task_type"] == TaskTypes.import_customer_blacklist_draft_to_live:
-        result = import_customer_blacklist_draft_to_live(task, collection_name, mongo_client)
-        break
-      elif task["task_type"] == TaskTypes.discard_customer_blacklist_xlsx_import_draft:
-        result = discard_customer_blacklist_xlsx_import_draft(task, mongo_client)
-        break
-      elif task["task_type"] == TaskTypes.import_customer_xlsx_to_draft:
-        result = import_customer_xlsx_to_draft(task, mongo_client)
-        break
-      elif task["task_type"] == TaskTypes.import_customer_draft_to_live:
-        result = import_customer_draft_to_live(task, collection_name, mongo_client)
-        break
-      elif task["task_type"] == TaskTypes.discard_customer_xlsx_import_draft:
-        result = discard_customer_xlsx_import_draft(task, mongo_client)
-        break
-      elif task["task_type"] == TaskTypes.export_customer_xlsx:
-        result = export_customer_xlsx(task, mongo_client)
-        break
-      else:
-        raise ValueError("task_type should be one of %s" % enum_set(TaskTypes))
-    except Exception as e:
-      err_msg = traceback.format_exc()
-      print(err_msg, file=sys.stderr)
-      task_col.update_one(
-        { "_id": task_id },
-        { 
-          "$set": {
-            "state": TaskStates.failed,
-            "result": { "message": str(e), "traceback": err_msg }
-          }
+    return
+  except pymongo.errors.ConnectionFailure as e:
+    err_msg = traceback.format_exc()
+    print(err_msg, file=sys.stderr)
+    # transient, another run resumes from the saved checkpoint
+    next_state = TaskStates.pending if task.get("trial", 0) < Config.BGTASK_MAX_RETRIAL else TaskStates.failed
+    task_col.update_one(
+      { "_id": task["_id"] },
+      {
+        "$set": {
+          "state": next_state,
+          "result": { "message": str(e), "traceback": err_msg }
         }
-      )
-      return
-    
+      }
+    )
+    return
+  except Exception as e:
+    err_msg = traceback.format_exc()
+    print(err_msg, file=sys.stderr)
+    task_col.update_one(
+      { "_id": task["_id"] },
+      {
+        "$set": {
+          "state": TaskStates.failed,
+          "result": { "message": str(e), "traceback": err_msg }
+        }
+      }
+    )
+    return
+  finally:
+    heartbeat.stop()
+
   # Mark task as completed
   task_col.update_one(
-    { "_id": task_id },
-    { 
+    { "_id": task["_id"] },
+    {
       "$set": {
         "state": TaskStates.success,
         "result": result,
@@ -79,3 +131,172 @@ def process_task(task_id, max_retrial=5, collection_name="bgtasks"):
       }
     }
   )
+
+def get_cap_exempt_priority():
+  # local config.py copies predating the setting keep the template default
+  return getattr(Config, "BGTASK_CAP_EXEMPT_PRIORITY", 30)
+
+def get_busy_creator_ids(task_col, max_running_per_creator, exempt_priority=None):
+  if exempt_priority is None:
+    exempt_priority = get_cap_exempt_priority()
+  busy_creators = task_col.aggregate([
+    { "$match": { "state": TaskStates.running, "priority": { "$lt": exempt_priority } } },
+    { "$group": { "_id": "$creator_id", "count": { "$sum": 1 } } },
+    { "$match": { "count": { "$gte": max_running_per_creator } } },
+  ])
+  return [creator["_id"] for creator in busy_creators]
+
+def claim_next_task(
+  task_col,
+  max_running_per_creator=Config.BGTASK_MAX_RUNNING_PER_CREATOR,
+  exempt_priority=None,
+):
+  # atomically move the pending task with the highest priority (oldest first)
+  # to running, so that concurrent workers never pick up the same task twice,
+  # creators already at their cap are skipped except for exempt priorities,
+  # two workers claiming at once may exceed it by one
+  query_filter = { "state": TaskStates.pending }
+  if exempt_priority is None:
+    exempt_priority = get_cap_exempt_priority()
+  if max_running_per_creator:
+    busy_creator_ids = get_busy_creator_ids(task_col, max_running_per_creator, exempt_priority)
+    if busy_creator_ids:
+      query_filter["$or"] = [
+        { "creator_id": { "$nin": busy_creator_ids } },
+        { "priority": { "$gte": exempt_priority } },
+      ]
+  return task_col.find_one_and_update(
+    query_filter,
+    {
+      "$set": {
+        "state": TaskStates.running,
+        "run_at": datetime.now(pytz.UTC),
+        "heartbeat_at": datetime.now(pytz.UTC),
+        "system_pid": os.getpid(),
+      },
+      "$inc": { "trial": 1 },
+    },
+    sort=[("priority", pymongo.DESCENDING), ("created_at", pymongo.ASCENDING)],
+    return_document=pymongo.ReturnDocument.AFTER,
+  )
+
+def requeue_stale_tasks(
+  task_col,
+  stale_timeout=Config.BGTASK_STALE_TIMEOUT,
+  max_retrial=Config.BGTASK_MAX_RETRIAL,
+):
+  # running tasks whose worker died (killed, OOM, host restart) stop beating,
+  # they go back to pending and resume from their checkpoint
+  stale_before = datetime.now(pytz.UTC) - timedelta(seconds=stale_timeout)
+  stale_filter = {
+    "state": TaskStates.running,
+    "$or": [
+      { "heartbeat_at": { "$lt": stale_before } },
+      { "heartbeat_at": None, "run_at": { "$lt": stale_before } },
+    ],
+  }
+  # a canceled task is not run again, only cleaned up
+  for task in task_col.find({ **stale_filter, "cancel_requested": True }, { "task_type": 1, "params": 1 }):
+    cleanup_result = cleanup_canceled_task(task, task_col.database.client)
+    task_col.update_one(
+      { "_id": task["_id"] },
+      {
+        "$set": {
+          "state": TaskStates.canceled,
+          "result": { "message": "task %s canceled" % task["_id"], "cleanup": cleanup_result },
+          "finished_at": datetime.now(pytz.UTC),
+        }
+      }
+    )
+  requeued = task_col.update_many(
+    { **stale_filter, "trial": { "$lt": max_retrial } },
+    { "$set": { "state": TaskStates.pending, "result": { "message": "worker heartbeat lost" } } },
+  )
+  failed = task_col.update_many(
+    stale_filter,
+    { "$set": { "state": TaskStates.failed, "result": { "message": "worker heartbeat lost, retrial exceeded" } } },
+  )
+  return requeued.modified_count, failed.modified_count
+
+def process_task(task_id, max_retrial=Config.BGTASK_MAX_RETRIAL, collection_name="bgtasks"):
+  # run a single task in the current process, kept for manual re-runs
+  mongo_client = get_mongo_client()
+  task_col = mongo_client.get_database().get_collection(collection_name)
+  task = task_col.find_one_and_update(
+    { "_id": task_id, "trial": { "$lt": max_retrial } },
+    {
+      "$set": {
+        "state": TaskStates.running,
+        "run_at": datetime.now(pytz.UTC),
+        "heartbeat_at": datetime.now(pytz.UTC),
+        "system_pid": os.getpid(),
+      },
+      "$inc": { "trial": 1 },
+    },
+    return_document=pymongo.ReturnDocument.AFTER,
+  )
+  if not task:
+    return
+  run_claimed_task(task, task_col, mongo_client, collection_name)
+
+def worker_loop(stop_event, poll_interval, collection_name="bgtasks"):
+  # one connection pool per worker process, reused across tasks
+  mongo_client = get_mongo_client()
+  task_col = mongo_client.get_database().get_collection(collection_name)
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+  while not stop_event.is_set():
+    try:
+      task = claim_next_task(task_col)
+    except pymongo.errors.PyMongoError:
+      print(traceback.format_exc(), file=sys.stderr)
+      task = None
+    if not task:
+      stop_event.wait(poll_interval)
+      continue
+    run_claimed_task(task, task_col, mongo_client, collection_name)
+  mongo_client.close()
+
+def run_worker_pool(
+  concurrency=Config.BGTASK_WORKER_CONCURRENCY,
+  poll_interval=Config.BGTASK_POLL_INTERVAL,
+  collection_name="bgtasks",
+):
+  stop_event = multiprocessing.Event()
+  def __spawn__():
+    # workers are not daemonic, task functions may start their own process pools
+    process = multiprocessing.Process(
+      target=worker_loop,
+      args=(stop_event, poll_interval, collection_name),
+    )
+    process.start()
+    return process
+
+  signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+  processes = [__spawn__() for _ in range(concurrency)]
+  print("%d background task workers started" % len(processes), file=sys.stderr)
+  # created after forking, the workers open their own clients
+  mongo_client = get_mongo_client()
+  task_col = mongo_client.get_database().get_collection(collection_name)
+  reaped_at = 0
+  try:
+    while not stop_event.is_set():
+      # replace crashed workers to keep the concurrency level
+      for index, process in enumerate(processes):
+        if not process.is_alive():
+          print("worker pid %s exited with %s, restarting" % (process.pid, process.exitcode), file=sys.stderr)
+          processes[index] = __spawn__()
+      if time.monotonic() - reaped_at >= Config.BGTASK_HEARTBEAT_INTERVAL:
+        try:
+          requeued_count, failed_count = requeue_stale_tasks(task_col)
+          if requeued_count or failed_count:
+            print("stale tasks: %d requeued, %d failed" % (requeued_count, failed_count), file=sys.stderr)
+        except pymongo.errors.PyMongoError:
+          print(traceback.format_exc(), file=sys.stderr)
+        reaped_at = time.monotonic()
+      time.sleep(poll_interval)
+  except KeyboardInterrupt:
+    stop_event.set()
+  for process in processes:
+    process.join()
+  mongo_client.close()
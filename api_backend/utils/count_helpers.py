@@ -0,0 +1,151 @@
+import math
+import time
+import pymongo
+from api_backend.utils.paging_helpers import merge_match_filters
+from config import Config
+# seconds before a collection with unhashed documents is checked again
+HASHED_CHECK_TTL = 60
+# expires_at by (collection, hash field) of the "every document hashed" check,
+# documents are hashed on write so a passed check never expires
+__hashed_checks__ = {}
+
+def get_grouped_field_paths(grouped_fields):
+  return [
+    field.strip() if field.strip().startswith("$") else "$" + field.strip()
+    for field in grouped_fields if type(field) is str and field.strip()
+  ]
+
+def get_group_key(grouped_field_paths):
+  # a scalar key for a single field, arrays only when grouping by several
+  return grouped_field_paths[0] if len(grouped_field_paths) == 1 else grouped_field_paths
+
+def get_covering_index(match_filter, grouped_field_paths, covering_indexes):
+  # first index holding the grouped fields and every filtered field, plain
+  # field filters only, the count then reads index keys instead of documents
+  if any(field.startswith("$") for field in match_filter):
+    return None
+  fields = set(match_filter) | { path[1:] for path in grouped_field_paths }
+  for index_keys in covering_indexes:
+    if fields <= set(index_keys):
+      return index_keys
+  return None
+
+def count_exact(collection, match_filter, grouped_field_paths, covering_indexes=[]):
+  # matched and distinct counts from a single pass over the matched documents,
+  # covered by an index of covering_indexes when the filter allows it,
+  # $group may spill to disk on broad filters
+  covering_index = get_covering_index(match_filter, grouped_field_paths, covering_indexes)
+  agg_stages = []
+  if match_filter:
+    agg_stages.append({ "$match": match_filter })
+  if covering_index:
+    agg_stages.append({ "$project": { "_id": 0, **{ path[1:]: 1 for path in grouped_field_paths } } })
+  agg_stages += [
+    { "$group": { "_id": get_group_key(grouped_field_paths), "count": { "$sum": 1 } } },
+    {
+      "$group": {
+        "_id": None,
+        "matched_count": { "$sum": "$count" },
+        "distinct_matched_count": { "$sum": 1 },
+      }
+    },
+  ]
+  aggregate_options = { "hint": list(covering_index.items()) } if covering_index else {}
+  results = list(collection.aggregate(agg_stages, allowDiskUse=True, **aggregate_options))
+  if not results:
+    return 0, 0
+  return results[0]["matched_count"], results[0]["distinct_matched_count"]
+
+def estimate_counts(collection, match_filter, hash_field, hash_bits, sketch_size):
+  # k minimum values sketch: the matched documents are read in hash order on the
+  # hash index until sketch_size distinct hashes are seen, with uniform hashes
+  # the k-th smallest one h_k covers a fraction h_k / 2 ** bits of the hash space,
+  # so (k - 1) / fraction estimates the distinct count and (documents read - 1) /
+  # fraction the matched count, returns (matched, distinct, relative standard error),
+  # the counts are exact when fewer distinct hashes were matched
+  cursor = collection.find(
+    merge_match_filters(match_filter, { hash_field: { "$ne": None } }),
+    { hash_field: 1, "_id": 0 },
+  ).sort(hash_field, pymongo.ASCENDING).batch_size(sketch_size)
+  hashes = set()
+  document_count = 0
+  try:
+    for document in cursor:
+      document_count += 1
+      hashes.add(document[hash_field])
+      if len(hashes) >= sketch_size:
+        break
+  finally:
+    cursor.close()
+  if len(hashes) < sketch_size:
+    return document_count, len(hashes), 0.0
+  fraction = (max(hashes) + 1) / (2 ** hash_bits)
+  return (
+    int(round((document_count - 1) / fraction)),
+    int(round((sketch_size - 1) / fraction)),
+    round(1 / math.sqrt(sketch_size - 2), 4),
+  )
+
+def is_fully_hashed(collection, hash_field):
+  check_key = (collection.full_name, hash_field)
+  if __hashed_checks__.get(check_key, 0) > time.monotonic():
+    return __hashed_checks__[check_key] == math.inf
+  fully_hashed = not collection.find_one({ hash_field: None }, { "_id": 1 })
+  __hashed_checks__[check_key] = math.inf if fully_hashed else time.monotonic() + HASHED_CHECK_TTL
+  return fully_hashed
+
+def is_broad_filter(collection, match_filter, sketch_size):
+  # the sketch reads about sketch_size * total / matched documents and the exact
+  # path the matched ones, the sketch only wins above sqrt(sketch_size * total)
+  # matches, bounded by that limit the count stays cheap on selective filters
+  if not match_filter:
+    return True
+  min_matched_count = int(math.sqrt(sketch_size * collection.estimated_document_count()))
+  return collection.count_documents(match_filter, limit=min_matched_count) >= min_matched_count
+
+def count_matched(
+  collection,
+  match_filter,
+  grouped_fields,
+  approximate=False,
+  hash_fields={},
+  unique_fields=[],
+  covering_indexes=[],
+  sketch_size=Config.COUNT_APPROXIMATE_SKETCH_SIZE,
+):
+  # matched_count and distinct_matched_count of GenericMatchCountDto,
+  # hash_fields maps grouped fields to their (hash field, hash bits), estimates
+  # need that hash on every document, e.g. after rebuild_search_fields,
+  # grouped fields listed in unique_fields have an unique index and are not grouped,
+  # approximate counts of selective filters are exact, see is_broad_filter
+  grouped_field_paths = get_grouped_field_paths(grouped_fields if type(grouped_fields) is list else [])
+  result = {
+    "grouped_fields": grouped_field_paths,
+    "approximate": False,
+    "distinct_error_bound": 0,
+  }
+  if not grouped_field_paths or tuple(grouped_field_paths) in unique_fields:
+    result["matched_count"] = collection.count_documents(match_filter)
+    result["distinct_matched_count"] = result["matched_count"]
+    return result
+  hash_field, hash_bits = hash_fields.get(tuple(grouped_field_paths), (None, None))
+  if (
+    approximate and hash_field
+    and is_fully_hashed(collection, hash_field)
+    and is_broad_filter(collection, match_filter, sketch_size)
+  ):
+    matched_count, distinct_count, error_bound = estimate_counts(
+      collection, match_filter, hash_field, hash_bits, sketch_size,
+    )
+    result.update({
+      "matched_count": matched_count,
+      # never above the matched count
+      "distinct_matched_count": min(distinct_count, matched_count),
+      "approximate": bool(error_bound),
+      "distinct_error_bound": error_bound,
+    })
+    return result
+  result["matched_count"], result["distinct_matched_count"] = count_exact(
+    collection, match_filter, grouped_field_paths, covering_indexes,
+  )
+  return result
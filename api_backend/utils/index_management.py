@@ -0,0 +1,94 @@
+import pymongo
+from api_backend.utils.mongo_helpers import build_mongo_indexes, generate_index_name, get_index_fields, split_mongo_index
+
+# options compared between declared and existing indexes
+COMPARED_INDEX_OPTIONS = ["unique", "expireAfterSeconds", "partialFilterExpression", "hidden", "collation"]
+
+def __normalize_option__(option, value):
+  if option == "collation" and type(value) is dict:
+    # the server fills every collation field, only compare the declared ones
+    return { "locale": value.get("locale"), "strength": value.get("strength") }
+  if option == "hidden":
+    return bool(value)
+  return value
+
+def __is_plain_index__(index_info):
+  return not any(index_info.get(option) for option in ["unique", "expireAfterSeconds", "partialFilterExpression", "sparse"])
+
+def diff_collection_indexes(collection, index_list):
+  # declared vs existing indexes of a collection, by generated index name
+  existing_indexes = collection.index_information()
+  declared_names = set()
+  missing, changed = [], []
+  for index_descriptor in index_list:
+    index_keys, options = split_mongo_index(index_descriptor)
+    index_name = generate_index_name(index_keys)
+    declared_names.add(index_name)
+    existing = existing_indexes.get(index_name)
+    if not existing:
+      missing.append(index_name)
+      continue
+    # text indexes are stored with their own internal key layout
+    key_differs = not any(type(order) is str for order in index_keys.values()) and \
+      [tuple(key) for key in existing["key"]] != get_index_fields(index_keys)
+    option_differs = any(
+      __normalize_option__(option, options.get(option)) != __normalize_option__(option, existing.get(option))
+      for option in COMPARED_INDEX_OPTIONS if option in options or existing.get(option)
+    )
+    if key_differs or option_differs:
+      changed.append(index_name)
+  undeclared = [
+    index_name for index_name in existing_indexes
+    if index_name != "_id_" and index_name not in declared_names
+  ]
+  return {
+    "existing_indexes": existing_indexes,
+    "missing": missing,
+    "changed": changed,
+    "undeclared": undeclared,
+  }
+
+def find_redundant_indexes(existing_indexes):
+  # a plain index whose keys are a prefix of another index is covered by it
+  redundant = []
+  for index_name, index_info in existing_indexes.items():
+    if index_name == "_id_" or not __is_plain_index__(index_info):
+      continue
+    keys = [tuple(key) for key in index_info["key"]]
+    for other_name, other_info in existing_indexes.items():
+      other_keys = [tuple(key) for key in other_info["key"]]
+      if other_name != index_name and len(other_keys) > len(keys) and other_keys[:len(keys)] == keys:
+        redundant.append((index_name, other_name))
+        break
+  return redundant
+
+def replace_changed_index(collection, index_descriptor, existing_info):
+  # mongo refuses two indexes on the same keys that only differ by e.g. `unique`,
+  # so the existing one is dropped first and restored if the declared one fails
+  index_keys, _ = split_mongo_index(index_descriptor)
+  index_name = generate_index_name(index_keys)
+  collection.drop_index(index_name)
+  try:
+    return build_mongo_indexes(collection, [index_descriptor], background=True)
+  except pymongo.errors.OperationFailure:
+    collection.create_index(
+      [tuple(key) for key in existing_info["key"]],
+      name=index_name,
+      background=True,
+      **{
+        option: existing_info[option]
+        for option in COMPARED_INDEX_OPTIONS + ["sparse"] if option in existing_info
+      },
+    )
+    raise
+
+def find_unused_indexes(collection):
+  # usage counters are kept per server since its last restart, None when unavailable
+  try:
+    index_stats = list(collection.aggregate([{ "$indexStats": {} }]))
+  except pymongo.errors.OperationFailure:
+    return None
+  return sorted({
+    stats["name"] for stats in index_stats
+    if stats["name"] != "_id_" and not stats.get("accesses", {}).get("ops")
+  })
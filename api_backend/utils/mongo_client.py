@@ -0,0 +1,115 @@
+import os
+import threading
+import pymongo
+from pymongo import monitoring
+from config import Config
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+  # connection counters by server address, updated by pymongo's pool events
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.pools = {}
+
+  def __count__(self, event, **increments):
+    address = "%s:%s" % event.address
+    with self.lock:
+      pool = self.pools.setdefault(address, {
+        "address": address,
+        "connections_created": 0,
+        "connections_closed": 0,
+        "checked_out": 0,
+        "checked_in": 0,
+        "checkout_failed": 0,
+        "pool_cleared": 0,
+      })
+      for key, increment in increments.items():
+        pool[key] += increment
+
+  def pool_created(self, event):
+    self.__count__(event)
+
+  def pool_ready(self, event):
+    pass
+
+  def pool_cleared(self, event):
+    self.__count__(event, pool_cleared=1)
+
+  def pool_closed(self, event):
+    pass
+
+  def connection_created(self, event):
+    self.__count__(event, connections_created=1)
+
+  def connection_ready(self, event):
+    pass
+
+  def connection_closed(self, event):
+    self.__count__(event, connections_closed=1)
+
+  def connection_check_out_started(self, event):
+    pass
+
+  def connection_check_out_failed(self, event):
+    self.__count__(event, checkout_failed=1)
+
+  def connection_checked_out(self, event):
+    self.__count__(event, checked_out=1)
+
+  def connection_checked_in(self, event):
+    self.__count__(event, checked_in=1)
+
+  def get_stats(self):
+    with self.lock:
+      return [
+        dict(
+          pool,
+          open_connections=pool["connections_created"] - pool["connections_closed"],
+          in_use=pool["checked_out"] - pool["checked_in"],
+        ) for pool in self.pools.values()
+      ]
+
+# (pid, client, metrics listener) by uri
+__clients__ = {}
+__clients_lock__ = threading.Lock()
+
+def __reset_lock_after_fork__():
+  # the lock may have been held by another thread of the parent when it forked
+  global __clients_lock__
+  __clients_lock__ = threading.Lock()
+
+os.register_at_fork(after_in_child=__reset_lock_after_fork__)
+
+def get_mongo_client(uri=None):
+  # one client, hence one connection pool, per process and uri shared by every
+  # service, it only connects on the first operation so modules may create
+  # services before gunicorn --preload or the worker pool forks: a forked
+  # process keeps the inherited client while it never connected in the parent,
+  # otherwise it gets its own client
+  uri = uri or Config.MONGO_MAIN_URI
+  pid = os.getpid()
+  with __clients_lock__:
+    entry = __clients__.get(uri)
+    if entry and (entry[0] == pid or not entry[2].pools):
+      __clients__[uri] = (pid, entry[1], entry[2])
+      return entry[1]
+    listener = PoolMetricsListener()
+    client = pymongo.MongoClient(
+      uri,
+      connect=False,
+      maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+      minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+      event_listeners=[listener],
+    )
+    __clients__[uri] = (pid, client, listener)
+    return client
+
+def get_mongo_pool_stats():
+  pid = os.getpid()
+  with __clients_lock__:
+    entries = [(uri, entry) for uri, entry in __clients__.items() if entry[0] == pid]
+  return {
+    "pid": pid,
+    "max_pool_size": Config.MONGO_MAX_POOL_SIZE,
+    "min_pool_size": Config.MONGO_MIN_POOL_SIZE,
+    "pools": [pool for _, entry in entries for pool in entry[2].get_stats()],
+  }
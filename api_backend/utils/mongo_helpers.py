@@ -66,14 +66,41 @@ def generate_index_name(index_descriptor):
     parts.append(f"{safe_field}_{order}")
   return '__'.join(parts)
 
-def build_mongo_index(collection, index_descriptor):
-  index_name = generate_index_name(index_descriptor)
-  existing_indexes = collection.index_information()
-  if index_name in existing_indexes:
-    return
-  index_fields = [
-    (field, 1 if order >= 0 else -1) 
-    for field, order in index_descriptor.items()
+class MongoIndex():
+  # index_list entry carrying create_index options along with the keys, e.g.
+  # MongoIndex({ "exp_datetime": 1 }, expireAfterSeconds=0) for a TTL index,
+  # unique, partialFilterExpression, collation and hidden are passed the same way,
+  # use "text" as the order of a field for a text index
+  def __init__(self, keys, **options):
+    self.keys = keys
+    self.options = options
+
+def split_mongo_index(index_descriptor):
+  if isinstance(index_descriptor, MongoIndex):
+    return index_descriptor.keys, index_descriptor.options
+  return index_descriptor, {}
+
+def get_index_fields(index_keys):
+  return [
+    (field, order if type(order) is str else (1 if order >= 0 else -1))
+    for field, order in index_keys.items()
   ]
-  collection.create_index(index_fields, name=index_name)
-  print("Index '%s.%s' created." % (collection.name, index_name))
+
+def build_mongo_indexes(collection, index_list, background=False):
+  # existing indexes are read once for the whole list
+  existing_indexes = collection.index_information()
+  created_index_names = []
+  for index_descriptor in index_list:
+    index_keys, options = split_mongo_index(index_descriptor)
+    index_name = generate_index_name(index_keys)
+    if index_name in existing_indexes:
+      continue
+    collection.create_index(
+      get_index_fields(index_keys), name=index_name, background=background, **options,
+    )
+    print("Index '%s.%s' created." % (collection.name, index_name))
+    created_index_names.append(index_name)
+  return created_index_names
+
+def build_mongo_index(collection, index_descriptor):
+  return build_mongo_indexes(collection, [index_descriptor])
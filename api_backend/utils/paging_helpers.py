@@ -0,0 +1,141 @@
+import base64
+import collections
+import hashlib
+import time
+import werkzeug.exceptions
+from bson import json_util
+from config import Config
+MATCHED_COUNT_CACHE_SIZE = 1024
+# (expires_at, matched_count) by filter key, shared by the process
+__matched_count_cache__ = collections.OrderedDict()
+
+# keyset pagination helpers, sort_fields is a list of (field, order) pairs
+# and should end with an unique tie-breaker such as _id
+def get_document_value(document, field):
+  value = document
+  for key in field.split("."):
+    if not isinstance(value, dict):
+      return None
+    value = value.get(key)
+  return value
+
+def encode_page_cursor(document, sort_fields):
+  payload = {
+    "fields": [field for field, _ in sort_fields],
+    "values": [get_document_value(document, field) for field, _ in sort_fields],
+  }
+  return base64.urlsafe_b64encode(json_util.dumps(payload).encode()).decode()
+
+def decode_page_cursor(cursor, sort_fields):
+  try:
+    payload = json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    fields, values = payload["fields"], payload["values"]
+  except Exception:
+    raise werkzeug.exceptions.BadRequest("invalid cursor `%s`" % cursor)
+  if fields != [field for field, _ in sort_fields] or type(values) is not list or len(values) != len(sort_fields):
+    raise werkzeug.exceptions.BadRequest("cursor does not match the sort options")
+  # values go into $gt / $lt filters, documents or arrays could inject operators
+  if any(isinstance(value, (dict, list)) for value in values):
+    raise werkzeug.exceptions.BadRequest("invalid cursor `%s`" % cursor)
+  return values
+
+def __beyond_filter__(field, order, value):
+  # null and missing values sort before everything else in mongo
+  if order >= 0:
+    if value is None:
+      return { field: { "$ne": None } }
+    return { field: { "$gt": value } }
+  if value is None:
+    return None
+  return { "$or": [ { field: { "$lt": value } }, { field: None } ] }
+
+def build_seek_filter(sort_fields, last_values):
+  # documents strictly after the last one in (field_1, ..., field_n) order:
+  # equal on the leading fields and beyond the last value on the next one
+  branches = []
+  for index, (field, order) in enumerate(sort_fields):
+    beyond = __beyond_filter__(field, order, last_values[index])
+    if beyond is None:
+      continue
+    branch = {
+      leading_field: leading_value
+      for (leading_field, _), leading_value in zip(sort_fields[:index], last_values[:index])
+    }
+    branch.update(beyond)
+    branches.append(branch)
+  if not branches:
+    return { "_id": { "$in": [] } }
+  return { "$or": branches }
+
+def merge_match_filters(*match_filters):
+  match_filters = [match_filter for match_filter in match_filters if match_filter]
+  if len(match_filters) > 1:
+    return { "$and": match_filters }
+  return match_filters[0] if match_filters else {}
+
+def get_matched_count_cache_key(collection, match_filter):
+  # compiled regexes are dumped with their pattern and flags
+  payload = json_util.dumps([collection.full_name, match_filter], sort_keys=True)
+  return hashlib.sha1(payload.encode()).hexdigest()
+
+def get_cached_matched_count(cache_key):
+  cached = __matched_count_cache__.get(cache_key)
+  if cached and cached[0] > time.monotonic():
+    return cached[1]
+  return None
+
+def set_cached_matched_count(cache_key, matched_count, ttl):
+  __matched_count_cache__[cache_key] = (time.monotonic() + ttl, matched_count)
+  __matched_count_cache__.move_to_end(cache_key)
+  while len(__matched_count_cache__) > MATCHED_COUNT_CACHE_SIZE:
+    __matched_count_cache__.popitem(last=False)
+
+def query_paged_results(
+  collection,
+  query_dto,
+  match_filter,
+  sort_fields,
+  post_stages=None,
+  count_cache_ttl=Config.PAGED_COUNT_CACHE_TTL,
+):
+  # shared page query for GenericPagedQueryDto, offset mode with page_number
+  # or keyset mode with `cursor`, post_stages (e.g. $lookup) only run on the page,
+  # with `count_matched` the count is cached for count_cache_ttl and reused by
+  # the next pages, the first page always recounts
+  page_size = query_dto.get("page_size")
+  page_number = query_dto.get("page_number")
+  cursor = query_dto.get("cursor")
+
+  agg_stages = []
+  matched_count = None
+  seek_filter = build_seek_filter(sort_fields, decode_page_cursor(cursor, sort_fields)) if cursor else {}
+  if match_filter or seek_filter:
+    agg_stages.append({"$match": merge_match_filters(match_filter, seek_filter)})
+  # check matched count, kept out of the page query so its $sort stays index backed
+  if bool(query_dto.get("count_matched")):
+    cache_ttl = count_cache_ttl.total_seconds()
+    cache_key = get_matched_count_cache_key(collection, match_filter) if cache_ttl > 0 else None
+    if cache_key and (cursor or page_number > 1):
+      matched_count = get_cached_matched_count(cache_key)
+    if matched_count is None:
+      matched_count = collection.count_documents(match_filter)
+      if cache_key:
+        set_cached_matched_count(cache_key, matched_count, cache_ttl)
+
+  agg_stages.append({"$sort": dict(sort_fields)})
+  if not cursor:
+    agg_stages.append({"$skip": page_size * (page_number - 1)})
+  agg_stages.append({"$limit": page_size + 1})
+  agg_stages += post_stages or []
+  results = list(collection.aggregate(agg_stages))
+  result = {
+    "results": results[:page_size],
+    "has_more": bool(len(results) > page_size),
+    "page_size": page_size,
+    "page_number": page_number,
+  }
+  if result["has_more"]:
+    result["next_cursor"] = encode_page_cursor(results[page_size - 1], sort_fields)
+  if not matched_count is None:
+    result["matched_count"] = matched_count
+  return result
@@ -0,0 +1,43 @@
+import hashlib
+import re
+# phone_hash is a positive int64, uniform over [0, 2 ** 63)
+PHONE_HASH_BITS = 63
+# hash_fields of utils.count_helpers.count_matched when grouping by phone
+PHONE_COUNT_HASH_FIELDS = { ("$phone",): ("phone_hash", PHONE_HASH_BITS) }
+
+def normalize_phone(phone):
+  # digits only, local mobile numbers are stored with the 886 country code
+  digits = re.sub(r'\D', '', phone)
+  if len(digits) == 10 and digits.startswith('09'):
+    digits = "886%s" % digits[1:]
+  if len(digits) == 9 and digits[0] == "9":
+    digits = "886%s" % digits
+  return digits
+
+def get_phone_hash(digits):
+  digest = hashlib.blake2b(digits.encode(), digest_size=8).digest()
+  return int.from_bytes(digest, "big") >> (64 - PHONE_HASH_BITS)
+
+def get_phone_search_fields(phone):
+  # indexed search keys, reversed digits turn a "last N digits" search into a prefix search,
+  # phone_hash feeds the distinct count estimates of utils.count_helpers
+  digits = normalize_phone(phone or "")
+  return {
+    "phone_digits": digits,
+    "phone_digits_rev": digits[::-1],
+    "phone_hash": get_phone_hash(digits),
+  }
+
+def get_phone_search_query(phone):
+  # anchored prefix / suffix lookups, both are index range scans
+  digits = re.sub(r'\D', '', phone)
+  if not digits:
+    return { "_id": { "$in": [] } }
+  prefixes = { digits }
+  if digits.startswith("0"):
+    prefixes.add("886%s" % digits[1:])
+  branches = [
+    { "phone_digits": re.compile("^%s" % prefix) } for prefix in sorted(prefixes)
+  ]
+  branches.append({ "phone_digits_rev": re.compile("^%s" % digits[::-1]) })
+  return { "$or": branches }
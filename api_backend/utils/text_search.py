@@ -0,0 +1,52 @@
+import re
+import threading
+import jieba
+from config import Config
+
+__tokenizer__ = None
+__tokenizer_lock__ = threading.Lock()
+# runs segmented into dictionary words, same range as jieba's full mode
+__han_re__ = re.compile("^[\u4E00-\u9FD5]+$")
+
+def get_tokenizer():
+  # the dictionary is loaded once per process on first use, from the local
+  # file when configured (no outbound network), else the one bundled with jieba
+  global __tokenizer__
+  with __tokenizer_lock__:
+    if __tokenizer__ is None:
+      tokenizer = jieba.Tokenizer(Config.LANGUAGE_DICT_PATH or jieba.DEFAULT_DICT)
+      tokenizer.initialize()
+      __tokenizer__ = tokenizer
+  return __tokenizer__
+
+def __is_token__(token):
+  return any(char.isalnum() for char in token)
+
+def __is_word__(token):
+  return len(token) > 1 and bool(__han_re__.match(token))
+
+def get_name_tokens(name):
+  # every dictionary word found in the name (full mode) plus every single
+  # character, stored in an indexed array so name search is a multikey index lookup
+  name = (name or "").strip().lower()
+  tokens = { token for token in get_tokenizer().cut(name, cut_all=True) if __is_word__(token) }
+  tokens.update(char for char in name if __is_token__(char))
+  return sorted(tokens)
+
+def get_name_search_fields(name):
+  return { "name_tokens": get_name_tokens(name) }
+
+def get_name_search_query(name):
+  # dictionary words of the query, without HMM guesses, are substrings of every
+  # matching name so its full mode tokens hold them, other segments fall back
+  # to their characters, the caller keeps the name regex to filter the candidates
+  tokens = set()
+  for segment in get_tokenizer().cut((name or "").strip().lower(), HMM=False):
+    if __is_word__(segment):
+      tokens.add(segment)
+    else:
+      tokens.update(char for char in segment if __is_token__(char))
+  if not tokens:
+    return None
+  # the index scan is bounded by the first token, the longest words are the rarest
+  return { "$all": sorted(tokens, key=lambda token: (-len(token), token)) }
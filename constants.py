@@ -81,12 +81,45 @@ class TaskTypes:
   import_customer_blacklist_xlsx_to_draft = "import_customer_blacklist_xlsx_to_draft"
   import_customer_blacklist_draft_to_live = "import_customer_blacklist_draft_to_live"
   discard_customer_blacklist_xlsx_import_draft = "discard_customer_blacklist_xlsx_import_draft"
+  rebuild_search_fields = "rebuild_search_fields"
+  dedup_customer_info = "dedup_customer_info"
+  dedup_customer_blacklist = "dedup_customer_blacklist"
+  reconcile_stats_counters = "reconcile_stats_counters"
+
+# workers claim higher priorities first, someone is usually waiting on
+# exports and discards while bulk imports and maintenance can queue
+TASK_TYPE_PRIORITIES = {
+  TaskTypes.export_customer_xlsx: 30,
+  TaskTypes.discard_customer_xlsx_import_draft: 30,
+  TaskTypes.discard_customer_blacklist_xlsx_import_draft: 30,
+  TaskTypes.import_customer_draft_to_live: 20,
+  TaskTypes.import_customer_blacklist_draft_to_live: 20,
+  TaskTypes.import_customer_xlsx_to_draft: 10,
+  TaskTypes.import_customer_blacklist_xlsx_to_draft: 10,
+  TaskTypes.rebuild_search_fields: 0,
+  TaskTypes.dedup_customer_info: 0,
+  TaskTypes.dedup_customer_blacklist: 0,
+  TaskTypes.reconcile_stats_counters: 0,
+}
+
+class PromotionModes:
+  # one server side $merge aggregation
+  merge = "merge"
+  # draft batches upserted through the app process
+  batch = "batch"
+
+class ExportFormats:
+  xlsx = "xlsx"
+  csv = "csv"
+  csv_gz = "csv.gz"
+  parquet = "parquet"
 
 class TaskStates:
   pending = "pending"
   running = "running"
   failed = "failed"
   success = "success"
+  canceled = "canceled"
 
 def enum_set(c):
   return set(
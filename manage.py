@@ -0,0 +1,93 @@
+import argparse
+import logging
+import pymongo
+
+from api_backend.schemas import MONGO_COLLECTION_SCHEMAS
+from api_backend.utils.index_management import (
+  diff_collection_indexes,
+  find_redundant_indexes,
+  find_unused_indexes,
+  replace_changed_index,
+)
+from api_backend.utils.mongo_client import get_mongo_client
+from api_backend.utils.mongo_helpers import build_mongo_indexes, generate_index_name, split_mongo_index
+
+
+def _indexes(parsed_args):
+  db = get_mongo_client().get_database()
+  for collection_name, schema in MONGO_COLLECTION_SCHEMAS.items():
+    collection = db.get_collection(collection_name)
+    index_list = schema.MongoMeta.index_list
+    diff = diff_collection_indexes(collection, index_list)
+    print("[%s]" % collection_name)
+    for index_name in diff["missing"]:
+      print("  missing:    %s" % index_name)
+    for index_name in diff["changed"]:
+      print("  changed:    %s (replaced with the declared options by --build)" % index_name)
+    for index_name in diff["undeclared"]:
+      print("  undeclared: %s" % index_name)
+    for index_name, covering_name in find_redundant_indexes(diff["existing_indexes"]):
+      print("  redundant:  %s (prefix of %s)" % (index_name, covering_name))
+    unused_index_names = find_unused_indexes(collection)
+    if unused_index_names is None:
+      print("  $indexStats unavailable")
+    for index_name in unused_index_names or []:
+      print("  unused:     %s" % index_name)
+    if parsed_args.build and diff["missing"]:
+      missing_index_list = [
+        index_descriptor for index_descriptor in index_list
+        if generate_index_name(split_mongo_index(index_descriptor)[0]) in diff["missing"]
+      ]
+      try:
+        build_mongo_indexes(collection, missing_index_list, background=True)
+      except pymongo.errors.OperationFailure:
+        # e.g. an unique index over duplicated data, see the dedup tasks,
+        # the other missing indexes are still built one by one
+        for index_descriptor in missing_index_list:
+          try:
+            build_mongo_indexes(collection, [index_descriptor], background=True)
+          except pymongo.errors.OperationFailure as e:
+            print("  failed:     %s" % e)
+    if parsed_args.build and diff["changed"]:
+      # e.g. the blacklist phone index, made unique after deployments built it plain
+      for index_descriptor in index_list:
+        index_name = generate_index_name(split_mongo_index(index_descriptor)[0])
+        if index_name not in diff["changed"]:
+          continue
+        try:
+          replace_changed_index(collection, index_descriptor, diff["existing_indexes"][index_name])
+          print("  replaced:   %s" % index_name)
+        except pymongo.errors.OperationFailure as e:
+          print("  failed:     %s, previous index restored (%s)" % (index_name, e))
+
+
+def _main():
+  try:
+    parsed_args = _parse_args()
+    logger = logging.getLogger()
+    logger.setLevel(logging.getLevelName(parsed_args.logging_level.upper()))
+    parsed_args.func(parsed_args)
+  except KeyboardInterrupt:
+    pass
+  except Exception as e:
+    logging.exception(e)
+    raise
+
+
+def _parse_args(args=None):
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-ll", "--logging-level", type=str, default="info", help="logging level")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  indexes_parser = subparsers.add_parser(
+    "indexes", help="diff declared and existing mongo indexes, report unused and redundant ones",
+  )
+  indexes_parser.add_argument(
+    "-b", "--build", action="store_true", help="build missing indexes in the background",
+  )
+  indexes_parser.set_defaults(func=_indexes)
+  parsed_args = parser.parse_args(args)
+  return parsed_args
+
+
+if __name__ == "__main__":
+  _main()
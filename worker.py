@@ -0,0 +1,40 @@
+import argparse
+import logging
+
+from api_backend.task_function.workers import run_worker_pool
+from config import Config
+
+
+def _main():
+  try:
+    parsed_args = _parse_args()
+    logger = logging.getLogger()
+    logger.setLevel(logging.getLevelName(parsed_args.logging_level.upper()))
+    run_worker_pool(
+      concurrency=parsed_args.concurrency,
+      poll_interval=parsed_args.poll_interval,
+    )
+  except KeyboardInterrupt:
+    pass
+  except Exception as e:
+    logging.exception(e)
+    raise
+
+
+def _parse_args(args=None):
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-ll", "--logging-level", type=str, default="info", help="logging level")
+  parser.add_argument(
+    "-c", "--concurrency", type=int, default=Config.BGTASK_WORKER_CONCURRENCY,
+    help="max number of background tasks running at the same time",
+  )
+  parser.add_argument(
+    "-p", "--poll-interval", type=float, default=Config.BGTASK_POLL_INTERVAL,
+    help="seconds to wait before polling again when the queue is empty",
+  )
+  parsed_args = parser.parse_args(args)
+  return parsed_args
+
+
+if __name__ == "__main__":
+  _main()